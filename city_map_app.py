@@ -2,16 +2,32 @@ import streamlit as st
 import osmnx as ox
 import geopandas as gpd
 from geopy.geocoders import Nominatim
-from functools import partial
+from functools import partial, wraps
 import matplotlib.pyplot as plt
 import matplotlib.font_manager as fm
 import networkx as nx
+import numpy as np
+import math
 import io
 import urllib.request
 import os
 from pathlib import Path
 import time
 import logging
+import json
+import hashlib
+from array import array
+import threading
+import contextvars
+import random
+import re
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+import requests
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -62,221 +78,4283 @@ st.markdown("""
     </style>
     """, unsafe_allow_html=True)
 
+# ---- Cache metrics ----
+# Per-cache counters for this server process, shown in the optional admin
+# panel and exported to a JSON file for sizing TTLs and memory budgets
+CACHE_METRICS_PATH = Path(os.environ.get("CACHE_METRICS_PATH", "cache_metrics.json"))
+CACHE_METRICS_INTERVAL = int(os.environ.get("CACHE_METRICS_INTERVAL", 60))
+ADMIN_PANEL = os.environ.get("ADMIN_PANEL", "0") == "1"
+
+_CACHE_COUNTERS = ('hits', 'misses', 'evictions', 'bytes_stored', 'bytes_evicted', 'hit_seconds', 'miss_seconds')
+
+_cache_metrics = {}
+_cache_metrics_lock = threading.Lock()
+
+# Set by the body of a Streamlit-cached function, which only runs on a miss
+_cache_call = threading.local()
+
+
+def _count_cache(cache, **amounts):
+    """Add amounts to a cache's counters"""
+    with _cache_metrics_lock:
+        counters = _cache_metrics.setdefault(cache, dict.fromkeys(_CACHE_COUNTERS, 0))
+        for name, amount in amounts.items():
+            counters[name] += amount
+
+
+def record_cache_hit(cache, seconds=0.0):
+    """Count a hit and the time it took"""
+    _count_cache(cache, hits=1, hit_seconds=seconds)
+
+
+def record_cache_miss(cache, seconds=0.0):
+    """Count a miss and the time computing the value took"""
+    _count_cache(cache, misses=1, miss_seconds=seconds)
+
+
+def record_cache_store(cache, size):
+    """Count bytes written to a cache"""
+    _count_cache(cache, bytes_stored=size)
+
+
+def record_cache_eviction(cache, size=0, count=1):
+    """Count entries evicted from a cache and their bytes"""
+    _count_cache(cache, evictions=count, bytes_evicted=size)
+
+
+def metered_cache(cache):
+    """
+    Count hits and misses of an st.cache_data function
+
+    The decorated function's body calls _mark_cache_miss(), so a call that
+    never reaches it was served from the cache.
+
+    Args:
+        cache: Metrics name of the cache
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            outer = getattr(_cache_call, 'missed', False)
+            _cache_call.missed = False
+            start = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = time.monotonic() - start
+                if _cache_call.missed:
+                    record_cache_miss(cache, elapsed)
+                else:
+                    record_cache_hit(cache, elapsed)
+                _cache_call.missed = outer
+        return wrapper
+    return decorator
+
+
+def _mark_cache_miss():
+    """Tell metered_cache that the cached function body ran"""
+    _cache_call.missed = True
+
+
+def cache_metrics_snapshot():
+    """
+    Read all cache counters with derived rates
+
+    Time saved assumes each hit would have cost an average miss.
+
+    Returns:
+        dict: cache name -> counters plus 'hit_rate' and 'time_saved'
+    """
+    with _cache_metrics_lock:
+        snapshot = {cache: dict(counters) for cache, counters in _cache_metrics.items()}
+
+    for counters in snapshot.values():
+        lookups = counters['hits'] + counters['misses']
+        average_miss = counters['miss_seconds'] / counters['misses'] if counters['misses'] else 0.0
+        counters['hit_rate'] = counters['hits'] / lookups if lookups else 0.0
+        counters['time_saved'] = max(0.0, counters['hits'] * average_miss - counters['hit_seconds'])
+    return snapshot
+
+
+def export_cache_metrics(path=None):
+    """Atomically write the cache metrics snapshot as JSON"""
+    path = Path(path or CACHE_METRICS_PATH)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps({'time': time.time(), 'pid': os.getpid(), 'caches': cache_metrics_snapshot()}, indent=2))
+    os.replace(tmp_path, path)
+
+
+def _run_metrics_exporter():
+    """Export the cache metrics every CACHE_METRICS_INTERVAL seconds"""
+    while True:
+        time.sleep(CACHE_METRICS_INTERVAL)
+        try:
+            export_cache_metrics()
+        except OSError as e:
+            logger.warning(f"Could not export cache metrics: {e}")
+
+
+# Started once per server process, by the first script run
+@st.cache_resource
+def start_metrics_exporter():
+    """Start the background cache metrics export thread"""
+    thread = threading.Thread(target=_run_metrics_exporter, name="metrics-exporter", daemon=True)
+    thread.start()
+    return thread
+
+
+def show_cache_metrics_panel():
+    """Draw the cache metrics table in the sidebar (admin panel)"""
+    import pandas as pd
+
+    snapshot = cache_metrics_snapshot()
+    with st.sidebar.expander("Cache Metrics (admin)"):
+        if not snapshot:
+            st.caption("No cache activity yet")
+            return
+        table = pd.DataFrame([
+            {
+                'Cache': cache,
+                'Hits': counters['hits'],
+                'Misses': counters['misses'],
+                'Hit rate': f"{counters['hit_rate']:.0%}",
+                'Evictions': counters['evictions'],
+                'Stored MB': round(counters['bytes_stored'] / 1e6, 1),
+                'Saved s': round(counters['time_saved'], 1),
+            }
+            for cache, counters in sorted(snapshot.items())
+        ]).set_index('Cache')
+        st.dataframe(table)
+        st.caption(f"Exported every {CACHE_METRICS_INTERVAL}s to {CACHE_METRICS_PATH}")
+
+
 # Download and cache font
 @st.cache_resource
 def load_custom_font():
     """Download and load Lato font"""
     try:
-        font_url = "https://github.com/google/fonts/raw/main/ofl/lato/Lato-Regular.ttf"
-        font_path = "Lato-Regular.ttf"
+        font_url = "https://github.com/google/fonts/raw/main/ofl/lato/Lato-Regular.ttf"
+        font_path = "Lato-Regular.ttf"
+
+        if not os.path.exists(font_path):
+            urllib.request.urlretrieve(font_url, font_path)
+            logger.info("Font downloaded successfully")
+
+        font_prop = fm.FontProperties(fname=font_path)
+        return font_prop
+    except Exception as e:
+        logger.warning(f"Could not load custom font: {e}")
+        return None
+
+# Geocode city with caching
+@metered_cache("geocode")
+@st.cache_data(ttl=86400)  
+def geocode_city(city_name):
+    """
+    Geocode a city name to coordinates with error handling
+    
+    Args:
+        city_name: Name of the city
+        timeout: Request timeout in seconds
+    
+    Returns:
+        tuple: (success, location_or_error_message)
+    """
+    _mark_cache_miss()
+    try:
+        # Use OSMnx's Built-in Geocoder
+        gdf = ox.geocode_to_gdf(city_name)
+        if gdf.empty:
+            return False, f"City '{city_name}' not found."
+
+        geom = gdf.iloc[0].geometry
+        lat = geom.centroid.y
+        lon = geom.centroid.x
+
+        return True, {
+            "latitude": lat,
+            "longitude": lon,
+            "address": city_name
+        }
+
+    except Exception as e:
+        return False, f"Geocoding error: {str(e)}"
+
+# Lat/lon decimals kept in request keys (~11 m), so geocoder jitter still hits the caches
+KEY_COORD_DECIMALS = 4
+
+def canonical_request(latitude, longitude, buffer_meters, crs_code):
+    """
+    Quantize a map request so logically identical requests share cache keys
+
+    Args:
+        latitude: City latitude
+        longitude: City longitude
+        buffer_meters: Buffer radius in meters
+        crs_code: Coordinate reference system EPSG code
+
+    Returns:
+        dict: Quantized latitude, longitude, buffer_meters, crs_code and
+            the canonical 'key' string built from them
+    """
+    # Adding 0.0 turns a rounded -0.0 into 0.0 so both format the same
+    lat = round(float(latitude), KEY_COORD_DECIMALS) + 0.0
+    lon = round(float(longitude), KEY_COORD_DECIMALS) + 0.0
+    radius = int(round(buffer_meters))
+    crs = int(crs_code)
+
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "buffer_meters": radius,
+        "crs_code": crs,
+        "key": f"{lat:.{KEY_COORD_DECIMALS}f},{lon:.{KEY_COORD_DECIMALS}f},{radius},{crs}"
+    }
+
+# Create buffer around city with caching
+@metered_cache("buffer")
+@st.cache_data(ttl=3600)  
+def create_city_buffer(latitude, longitude, buffer_meters, crs_code):
+    """
+    Create a buffered area around city coordinates
+
+    Args:
+        latitude: City latitude
+        longitude: City longitude
+        buffer_meters: Buffer radius in meters
+        crs_code: Coordinate reference system EPSG code
+
+    Returns:
+        tuple: (success, geodataframe_or_error_message)
+    """
+    _mark_cache_miss()
+    try:
+        # Create GeoDataFrame from coordinates
+        cities_df = gpd.GeoDataFrame(
+            {'geometry': [gpd.points_from_xy([longitude], [latitude])[0]]},
+            crs='EPSG:4326'
+        )
+
+        # Transform to specified CRS for accurate buffering
+        cities_df = cities_df.to_crs(epsg=crs_code)
+        cities_df['buffer'] = cities_df.geometry.buffer(buffer_meters)
+        cities_df = cities_df.set_geometry('buffer')
+
+        # Transform back to WGS84 for OSM queries
+        cities_df = cities_df.to_crs(epsg=4326)
+
+        logger.info(f"Buffer created: {buffer_meters}m radius")
+        return True, cities_df
+
+    except Exception as e:
+        logger.error(f"Buffer creation error: {str(e)}")
+        return False, f"Error creating buffer: {str(e)}"
+
+# Highway values that never belong to a given network type. These mirror the
+# OSMnx network_type filters so subgraphs can be derived from the full network
+NETWORK_EXCLUDED_HIGHWAYS = {
+    'drive': {
+        'abandoned', 'bridleway', 'bus_guideway', 'construction', 'corridor',
+        'cycleway', 'elevator', 'escalator', 'footway', 'no', 'path',
+        'pedestrian', 'planned', 'platform', 'proposed', 'raceway', 'razed',
+        'rest_area', 'service', 'services', 'steps', 'track'
+    },
+    'bike': {
+        'abandoned', 'bus_guideway', 'construction', 'corridor', 'elevator',
+        'escalator', 'footway', 'motorway', 'motorway_link', 'no', 'planned',
+        'platform', 'proposed', 'raceway', 'razed', 'rest_area', 'services',
+        'steps'
+    },
+    'walk': {
+        'abandoned', 'bus_guideway', 'construction', 'cycleway', 'motorway',
+        'motorway_link', 'no', 'planned', 'platform', 'proposed', 'raceway',
+        'razed', 'rest_area', 'services'
+    },
+}
+
+# Other tag values that exclude a way from a given network type
+NETWORK_EXCLUDED_TAGS = {
+    'drive': {
+        'access': {'private'},
+        'motor_vehicle': {'no'},
+        'motorcar': {'no'},
+        'service': {'alley', 'driveway', 'emergency_access', 'parking', 'parking_aisle', 'private'},
+    },
+    'bike': {
+        'access': {'private'},
+        'bicycle': {'no'},
+        'service': {'private'},
+    },
+    'walk': {
+        'access': {'private'},
+        'foot': {'no'},
+        'service': {'private'},
+        # Streets whose sidewalks are mapped as their own footways
+        'sidewalk': {'separate'},
+        'sidewalk:both': {'separate'},
+        'sidewalk:left': {'separate'},
+        'sidewalk:right': {'separate'},
+    },
+}
+
+# Extra way tags OSMnx must keep so the filters above can be evaluated
+NETWORK_FILTER_TAGS = [
+    'access', 'service', 'foot', 'bicycle', 'motor_vehicle', 'motorcar',
+    'sidewalk', 'sidewalk:both', 'sidewalk:left', 'sidewalk:right'
+]
+
+# Simplifying the full network must not merge ways the filters above tell
+# apart (e.g. a road continuing as a footway), or a derived network would
+# keep or drop the merged edge as a whole
+SIMPLIFY_EDGE_ATTRS_DIFFER = ['highway'] + NETWORK_FILTER_TAGS
+
+
+def _tag_values(value):
+    """Return edge tag values as a list (simplified edges may hold lists)"""
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _tag_in_network(tag, value, network_type):
+    """
+    Check one tag of an edge against the filters of a network type
+
+    Args:
+        tag: Tag name ('highway' or one of NETWORK_FILTER_TAGS)
+        value: Tag value, a list of values or None
+        network_type: Type of network ('drive', 'bike', 'walk')
+
+    Returns:
+        bool: False if this tag alone excludes the edge
+    """
+    values = _tag_values(value)
+    if tag == 'highway':
+        # An edge needs at least one highway value the network allows
+        return any(h not in NETWORK_EXCLUDED_HIGHWAYS[network_type] for h in values)
+    excluded_values = NETWORK_EXCLUDED_TAGS[network_type].get(tag, ())
+    return not (values and all(v in excluded_values for v in values))
+
+
+def edge_in_network(edge_data, network_type):
+    """
+    Check whether an edge of the full network belongs to a network type
+
+    Args:
+        edge_data: Edge attribute dict from the full OSMnx graph
+        network_type: Type of network ('drive', 'bike', 'walk', 'all')
+
+    Returns:
+        bool: True if the edge should be kept for this network type
+    """
+    if network_type == 'all':
+        return True
+    return all(
+        _tag_in_network(tag, edge_data.get(tag), network_type)
+        for tag in ['highway', *NETWORK_EXCLUDED_TAGS[network_type]]
+    )
+
+
+def extract_network(graph, network_type):
+    """
+    Derive a network type subgraph from the full network graph
+
+    Args:
+        graph: Full NetworkX graph downloaded with network_type 'all'
+        network_type: Type of network ('drive', 'bike', 'walk', 'all')
+
+    Returns:
+        networkx.MultiDiGraph: Subgraph with only the matching edges
+    """
+    if network_type == 'all':
+        return graph
+
+    edges = [
+        (u, v, k) for u, v, k, data in graph.edges(keys=True, data=True)
+        if edge_in_network(data, network_type)
+    ]
+    return graph.edge_subgraph(edges).copy()
+
+
+# Attributes kept on network graphs: edge geometry, the highway class, the
+# tags the drive/bike/walk filters read and the way IDs the delta refresh
+# matches changes by. Names, lanes, maxspeed, ref, bridge, tunnel and the
+# rest are dropped from the full network before it is stored or shared
+NETWORK_EDGE_ATTRIBUTES = [
+    attr.strip() for attr in os.environ.get(
+        "NETWORK_EDGE_ATTRIBUTES", ",".join(['geometry', 'length', 'highway', 'oneway', 'osmid'] + NETWORK_FILTER_TAGS)
+    ).split(',') if attr.strip()
+]
+
+# Node coordinates are always kept
+NETWORK_NODE_ATTRIBUTES = [
+    attr.strip() for attr in os.environ.get("NETWORK_NODE_ATTRIBUTES", "").split(',') if attr.strip()
+]
+
+
+def _freed_bytes(values):
+    """
+    Estimate the memory freed by dropping attribute values
+
+    Only values nothing else references are counted, so interned tag
+    strings and values shared with the graph a copy was made from free
+    just their dict slot.
+
+    Args:
+        values: List holding the dropped values, their last reference here
+
+    Returns:
+        int: Estimated bytes freed once the list is dropped
+    """
+    import sys
+
+    # Reference count of an object held only by the list
+    values.append(object())
+    owned = sys.getrefcount(values[-1])
+    values.pop()
+
+    freed = len(values) * 3 * 8
+    for i in range(len(values)):
+        if sys.getrefcount(values[i]) > owned:
+            continue
+        freed += sys.getsizeof(values[i])
+        if isinstance(values[i], list):
+            item_owned = owned + 1
+            freed += sum(sys.getsizeof(item) for item in values[i] if sys.getrefcount(item) <= item_owned)
+    return freed
+
+
+def prune_graph_attributes(graph, edge_attributes=None, node_attributes=None):
+    """
+    Drop every node and edge attribute not on the whitelists, in place
+
+    Args:
+        graph: NetworkX graph that is not frozen or shared yet
+        edge_attributes: Edge attributes to keep (NETWORK_EDGE_ATTRIBUTES if None)
+        node_attributes: Node attributes to keep besides x and y
+            (NETWORK_NODE_ATTRIBUTES if None)
+
+    Returns:
+        int: Estimated bytes freed
+    """
+    edge_keep = set(NETWORK_EDGE_ATTRIBUTES if edge_attributes is None else edge_attributes)
+    node_keep = {'x', 'y'} | set(NETWORK_NODE_ATTRIBUTES if node_attributes is None else node_attributes)
+
+    dropped = []
+    for _, _, data in graph.edges(data=True):
+        for attr in [attr for attr in data if attr not in edge_keep]:
+            dropped.append(data.pop(attr))
+    for _, data in graph.nodes(data=True):
+        for attr in [attr for attr in data if attr not in node_keep]:
+            dropped.append(data.pop(attr))
+    return _freed_bytes(dropped)
+
+
+# ---- OSMnx Performance Settings ----
+def configure_osmnx():
+    """Apply the OSMnx settings used for every network download"""
+    ox.settings.use_cache = True              
+    ox.settings.log_console = False           
+    ox.settings.requests_timeout = 180                 
+    ox.settings.max_query_area_size = 50_000_000  
+
+    # Keep the tags needed to derive drive/bike/walk subgraphs
+    for tag in NETWORK_FILTER_TAGS:
+        if tag not in ox.settings.useful_tags_way:
+            ox.settings.useful_tags_way = ox.settings.useful_tags_way + [tag]
+
+
+# ---- Overpass fetch scheduler ----
+# Comma-separated pool of Overpass API base URLs, tried in order of health
+OVERPASS_ENDPOINTS = [
+    url.strip().rstrip('/') for url in os.environ.get(
+        "OVERPASS_ENDPOINTS",
+        "https://overpass-api.de/api,https://overpass.kumi.systems/api,https://overpass.private.coffee/api"
+    ).split(',') if url.strip()
+]
+
+# Retry policy for rate limiting (429) and gateway timeouts (504)
+OVERPASS_MAX_ATTEMPTS = 4
+OVERPASS_BACKOFF_BASE = 2
+OVERPASS_BACKOFF_MAX = 60
+RETRYABLE_STATUS_CODES = {429, 502, 503, 504}
+
+# A duplicate request goes to a second endpoint once the first has not
+# started answering within this percentile of its recent times to first byte
+HEDGE_LATENCY_PERCENTILE = 90
+HEDGE_MIN_DELAY = 5
+HEDGE_DEFAULT_DELAY = 30
+
+# Consecutive failures that open an endpoint's circuit, and for how long
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN = 120
+
+_endpoint_state = {
+    url: {'latencies': deque(maxlen=50), 'failures': 0, 'open_until': 0.0}
+    for url in OVERPASS_ENDPOINTS
+}
+_endpoint_lock = threading.Lock()
+
+# Set by background refreshes, which must not reread cached responses. Context
+# variables reach tile workers, which are started with a copy of the context
+_http_cache_bypass = contextvars.ContextVar("http_cache_bypass", default=False)
+
+# Data times of the responses read by the running fetch (see fetch_with_snapshot_time)
+_response_times = contextvars.ContextVar("response_times", default=None)
+
+# Shared pool so a slow losing request never blocks the caller
+_overpass_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="overpass")
+
+# Pool replacing the shared one for the current context (the cache warm-up's
+# own, low-priority pool). Threads inherit the niceness of the thread that
+# starts them, so low-priority work must never start shared pool threads
+_overpass_pool = contextvars.ContextVar("overpass_pool", default=None)
+
+
+class OverpassRequestError(Exception):
+    """An Overpass request failed; retryable errors may succeed elsewhere or later"""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+# Share of the download step reached when each phase starts; "Downloading"
+# grows with bytes received, since Overpass does not announce response sizes
+PROGRESS_PHASES = {
+    'Checking cache': 0.0,
+    'Downloading': 0.0,
+    'Parsing': 0.6,
+    'Building graph': 0.65,
+    'Simplifying graph': 0.8,
+    'Storing graph': 0.9,
+    'Extracting networks': 0.95,
+}
+
+# Bytes received at which the download phase shows as half done
+PROGRESS_HALF_BYTES = 20 * 1024 ** 2
+
+# Seconds between progress updates pushed to the UI
+PROGRESS_POLL_INTERVAL = 0.25
+
+# Elements counted locally before being added to the shared counter
+PROGRESS_ELEMENT_BATCH = 10000
+
+
+class DownloadProgress:
+    """Thread-safe telemetry of one map request, read by the UI while it downloads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.bytes_received = 0
+        self.elements_parsed = 0
+        self.phase = 'Checking cache'
+        self.started = time.monotonic()
+        self._fraction = 0.0
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes_received += count
+
+    def add_elements(self, count):
+        with self._lock:
+            self.elements_parsed += count
+
+    def set_phase(self, phase):
+        with self._lock:
+            self.phase = phase
+
+    def snapshot(self):
+        """
+        Read the counters consistently
+
+        Returns:
+            dict: bytes, elements, phase, elapsed seconds and fraction (0-1)
+        """
+        with self._lock:
+            fraction = PROGRESS_PHASES.get(self.phase, 0.0)
+            if self.phase == 'Downloading':
+                fraction = 0.6 * self.bytes_received / (self.bytes_received + PROGRESS_HALF_BYTES)
+            # Multi-query and tiled fetches re-enter earlier phases; never move back
+            self._fraction = max(self._fraction, fraction)
+            return {
+                'bytes': self.bytes_received,
+                'elements': self.elements_parsed,
+                'phase': self.phase,
+                'elapsed': time.monotonic() - self.started,
+                'fraction': self._fraction,
+            }
+
+    def log_throughput(self, label):
+        """Log the request's totals and transfer rates"""
+        snapshot = self.snapshot()
+        elapsed = max(snapshot['elapsed'], 1e-9)
+        logger.info(
+            f"{label}: {snapshot['bytes'] / 1e6:.1f} MB, {snapshot['elements']:,} elements in {elapsed:.1f}s "
+            f"({snapshot['bytes'] / 1e6 / elapsed:.2f} MB/s, {snapshot['elements'] / elapsed:,.0f} elements/s)"
+        )
+
+
+def poll_with_progress(futures, progress=None, on_progress=None):
+    """
+    Yield futures as they finish, reporting progress from the calling thread meanwhile
+
+    Args:
+        futures: Iterable of futures
+        progress: DownloadProgress shared by the work, if any
+        on_progress: Optional callback(snapshot) run every PROGRESS_POLL_INTERVAL
+
+    Yields:
+        Finished futures in completion order
+    """
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, timeout=PROGRESS_POLL_INTERVAL, return_when=FIRST_COMPLETED)
+        if progress and on_progress:
+            on_progress(progress.snapshot())
+        yield from done
+
+
+def _ranked_endpoints():
+    """Return endpoints with closed circuits first, then fewest recent failures, then fastest"""
+    now = time.time()
+    with _endpoint_lock:
+        def rank(url):
+            state = _endpoint_state[url]
+            latency = float(np.median(state['latencies'])) if state['latencies'] else 0.0
+            return (state['open_until'] > now, state['failures'], latency)
+        return sorted(OVERPASS_ENDPOINTS, key=rank)
+
+
+def _circuit_open(url):
+    """Whether an endpoint's circuit breaker is currently open"""
+    with _endpoint_lock:
+        return _endpoint_state[url]['open_until'] > time.time()
+
+
+def _hedge_delay(url):
+    """Seconds to wait for an endpoint's first byte before sending a hedged duplicate"""
+    with _endpoint_lock:
+        latencies = list(_endpoint_state[url]['latencies'])
+    if len(latencies) < 5:
+        return HEDGE_DEFAULT_DELAY
+    return max(HEDGE_MIN_DELAY, float(np.percentile(latencies, HEDGE_LATENCY_PERCENTILE)))
+
+
+def _record_endpoint_result(url, success, latency=None):
+    """Update an endpoint's time-to-first-byte history and circuit breaker"""
+    with _endpoint_lock:
+        state = _endpoint_state[url]
+        if success:
+            state['failures'] = 0
+            state['open_until'] = 0.0
+            state['latencies'].append(latency)
+            return
+
+        state['failures'] += 1
+        if state['failures'] >= BREAKER_FAILURE_THRESHOLD:
+            state['open_until'] = time.time() + BREAKER_COOLDOWN
+            logger.warning(f"Circuit open for {urlparse(url).netloc} for {BREAKER_COOLDOWN}s")
+
+
+def _discard_response_file(future):
+    """Delete the response file of a hedged request that lost the race"""
+    try:
+        path = future.result()
+    except Exception:
+        return
+    Path(path).unlink(missing_ok=True)
+
+
+def _post_overpass(url, query, progress=None, started=None, cancelled=None, timeout=None):
+    """
+    Send one query to one endpoint and stream the response body to disk
+
+    The endpoint's latency is recorded as time to first byte, which does
+    not depend on how large the answer is.
+
+    Args:
+        url: Endpoint base URL
+        query: Overpass QL query string
+        progress: Optional DownloadProgress receiving the bytes downloaded
+        started: Optional Event set once the endpoint starts answering
+        cancelled: Optional Event that aborts the download when set
+        timeout: Seconds to wait for the endpoint; the OSMnx setting if None
+
+    Returns:
+        Path: Temporary file holding the raw response JSON
+    """
+    host = urlparse(url).netloc
+    start = time.monotonic()
+    try:
+        response = requests.post(
+            f"{url}/interpreter",
+            data={'data': query},
+            timeout=timeout or ox.settings.requests_timeout,
+            headers=ox._http._get_http_headers(),
+            stream=True,
+            **ox.settings.requests_kwargs
+        )
+    except requests.RequestException as e:
+        _record_endpoint_result(url, False)
+        raise OverpassRequestError(f"{host}: {e}")
+
+    first_byte = time.monotonic() - start
+    with response:
+        if response.status_code in RETRYABLE_STATUS_CODES:
+            _record_endpoint_result(url, False)
+            raise OverpassRequestError(f"{host}: HTTP {response.status_code} {response.reason}")
+        if not response.ok:
+            # The server is healthy but rejected the query; retrying won't help
+            _record_endpoint_result(url, True, first_byte)
+            raise OverpassRequestError(f"{host}: HTTP {response.status_code} {response.reason}", retryable=False)
+        if started:
+            started.set()
+
+        RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        if progress:
+            progress.set_phase('Downloading')
+        with tempfile.NamedTemporaryFile(dir=RESPONSE_CACHE_DIR, suffix='.part', delete=False) as spool:
+            path = Path(spool.name)
+            try:
+                for chunk in response.iter_content(OVERPASS_READ_CHUNK):
+                    if cancelled and cancelled.is_set():
+                        # Lost the race; not a failure of the endpoint
+                        spool.close()
+                        path.unlink(missing_ok=True)
+                        raise OverpassRequestError(f"{host}: cancelled", retryable=False)
+                    spool.write(chunk)
+                    if progress:
+                        progress.add_bytes(len(chunk))
+            except requests.RequestException as e:
+                spool.close()
+                path.unlink(missing_ok=True)
+                _record_endpoint_result(url, False)
+                raise OverpassRequestError(f"{host}: {e}")
+            size = spool.tell()
+
+    # Overpass reports query timeouts and memory exhaustion as a 200 remark,
+    # which comes after the elements at the very end of the body
+    with open(path, 'rb') as f:
+        f.seek(max(0, size - 4096))
+        tail = f.read().decode('utf-8', errors='replace')
+    remark = re.search(r'"remark"\s*:\s*("(?:[^"\\]|\\.)*")', tail)
+    if remark and 'runtime error' in remark.group(1):
+        path.unlink(missing_ok=True)
+        _record_endpoint_result(url, False)
+        raise OverpassRequestError(f"{host}: {json.loads(remark.group(1))}")
+
+    _record_endpoint_result(url, True, first_byte)
+    logger.info(f"Overpass {host}: {size / 1e6:.1f} MB in {time.monotonic() - start:.1f}s "
+                f"(first byte after {first_byte:.1f}s)")
+    return path
+
+
+def _hedged_request(query, progress=None, timeout=None):
+    """
+    Send a query to the healthiest endpoint, hedging to a second if it is slow
+
+    Only a primary that has not started answering is hedged, and only to an
+    endpoint whose circuit is closed. The losing request is cancelled.
+
+    Returns:
+        Path: Response file of whichever request succeeds first
+    """
+    endpoints = _ranked_endpoints()
+    primary = endpoints[0]
+    backup = next((url for url in endpoints[1:] if not _circuit_open(url)), None)
+    started = threading.Event()
+    cancels = {}
+
+    def submit(url, started_event=None):
+        cancel = threading.Event()
+        executor = _overpass_pool.get() or _overpass_executor
+        future = executor.submit(_post_overpass, url, query, progress, started_event, cancel, timeout)
+        cancels[future] = cancel
+        return future
+
+    pending = {submit(primary, started)}
+    hedged = backup is None
+    error = None
+
+    while pending:
+        done, pending = wait(pending, timeout=None if hedged else _hedge_delay(primary), return_when=FIRST_COMPLETED)
+        if not done:
+            hedged = True
+            if started.is_set():
+                # Already streaming its answer; a duplicate would only compete for bandwidth
+                continue
+            logger.info(f"{urlparse(primary).netloc} is slow; hedging to {urlparse(backup).netloc}")
+            pending.add(submit(backup))
+            continue
+
+        for future in done:
+            try:
+                path = future.result()
+            except OverpassRequestError as e:
+                error = e
+                continue
+            for loser in pending:
+                cancels[loser].set()
+                loser.add_done_callback(_discard_response_file)
+            return path
+
+        # A fast failure is left to the retry loop, which picks a healthier endpoint
+        if not hedged:
+            break
+
+    raise error
+
+
+# ---- Overpass response cache ----
+# Responses are kept zstd-compressed in their own folder. An index (key ->
+# size and access times) answers lookups without scanning the folder and
+# keeps it under a byte cap by evicting the least recently used responses.
+# OSMnx's cache folder holds only what OSMnx writes itself (Nominatim
+# geocoding responses), so compaction never touches those files
+RESPONSE_CACHE_DIR = Path(os.environ.get("RESPONSE_CACHE_DIR", "cache/overpass"))
+
+RESPONSE_CACHE_MAX_BYTES = int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 1024 ** 3))
+
+# zstd levels: fast for responses written while a user waits, strong for compaction
+RESPONSE_CACHE_LEVEL = 3
+RESPONSE_CACHE_COMPACT_LEVEL = 19
+
+RESPONSE_CACHE_INDEX = "response_index.json"
+
+# The app and cache-admin runs update the index from separate processes, so
+# every read-modify-write of it holds an flock on this file
+RESPONSE_CACHE_LOCK = "response_index.lock"
+
+_response_cache_lock = threading.Lock()
+
+
+@contextmanager
+def _response_cache_locked():
+    """
+    Hold the response cache index lock, across threads and processes
+
+    Platforms without fcntl only get the in-process lock.
+    """
+    with _response_cache_lock:
+        try:
+            import fcntl
+        except ImportError:
+            yield
+            return
+
+        RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        with open(RESPONSE_CACHE_DIR / RESPONSE_CACHE_LOCK, 'a') as lock_file:
+            # Closing the file releases the lock
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+
+def response_cache_key(query):
+    """Cache key of an Overpass query, independent of the endpoint answering it"""
+    return hashlib.sha256(query.encode()).hexdigest()[:32]
+
+
+def _response_cache_path(key):
+    """Path of a cached compressed response"""
+    return RESPONSE_CACHE_DIR / f"{key}.json.zst"
+
+
+def _load_response_cache_index():
+    """Read the response cache index (key -> entry metadata)"""
+    index_path = RESPONSE_CACHE_DIR / RESPONSE_CACHE_INDEX
+    if not index_path.exists():
+        return {}
+    try:
+        return json.loads(index_path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Response cache index unreadable, starting fresh: {e}")
+        return {}
+
+
+def _save_response_cache_index(index):
+    """Atomically write the response cache index; call with the index lock held"""
+    RESPONSE_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    with tempfile.NamedTemporaryFile('w', dir=RESPONSE_CACHE_DIR, prefix=f"{RESPONSE_CACHE_INDEX}.", suffix='.tmp', delete=False) as tmp:
+        tmp.write(json.dumps(index))
+    os.replace(tmp.name, RESPONSE_CACHE_DIR / RESPONSE_CACHE_INDEX)
+
+
+def _compress_to_temp(source_path, target_path, level):
+    """zstd-compress a file to a uniquely named file next to target_path"""
+    import zstandard as zstd
+
+    with open(source_path, 'rb') as source, tempfile.NamedTemporaryFile(
+        dir=target_path.parent, prefix=f"{target_path.name}.", suffix='.tmp', delete=False
+    ) as target:
+        try:
+            zstd.ZstdCompressor(level=level).copy_stream(source, target)
+        except BaseException:
+            target.close()
+            Path(target.name).unlink(missing_ok=True)
+            raise
+    return Path(target.name)
+
+
+def open_response(path):
+    """
+    Open a response file as a binary stream, decompressing cached responses
+
+    Args:
+        path: Response path from overpass_request
+
+    Returns:
+        Binary file-like object
+    """
+    import zstandard as zstd
+
+    if Path(path).suffix == '.zst':
+        return zstd.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, 'rb')
+
+
+def response_cache_get(query, max_age=None):
+    """
+    Look up a cached response
+
+    Args:
+        query: Overpass QL query string
+        max_age: Seconds after which a response counts as missing
+
+    Returns:
+        tuple or None: (compressed response file, time it was downloaded)
+    """
+    key = response_cache_key(query)
+    with _response_cache_locked():
+        index = _load_response_cache_index()
+        entry = index.get(key)
+        if entry is None:
+            return None
+        if max_age is not None and time.time() - entry['created'] > max_age:
+            return None
+        path = _response_cache_path(key)
+        if not path.exists():
+            del index[key]
+            _save_response_cache_index(index)
+            return None
+        entry['last_access'] = time.time()
+        _save_response_cache_index(index)
+    return path, entry['created']
+
+
+def response_cache_put(query, raw_path):
+    """
+    Compress a downloaded response into the cache and evict over the byte cap
+
+    Args:
+        query: Overpass QL query string
+        raw_path: Uncompressed response file; removed once cached
+
+    Returns:
+        Path: Compressed response file
+    """
+    key = response_cache_key(query)
+    path = _response_cache_path(key)
+    raw_bytes = Path(raw_path).stat().st_size
+    try:
+        compressed_path = _compress_to_temp(raw_path, path, RESPONSE_CACHE_LEVEL)
+    finally:
+        Path(raw_path).unlink(missing_ok=True)
+
+    with _response_cache_locked():
+        # Swapped in under the lock so a running compaction cannot overwrite it
+        os.replace(compressed_path, path)
+        size = path.stat().st_size
+        index = _load_response_cache_index()
+        now = time.time()
+        index[key] = {'bytes': size, 'raw_bytes': raw_bytes, 'created': now, 'last_access': now}
+        record_cache_store("responses", size)
+        _evict_response_cache(index, RESPONSE_CACHE_MAX_BYTES, keep=key)
+        _save_response_cache_index(index)
+
+    logger.info(f"Cached response {key}: {raw_bytes / 1e6:.1f} MB -> {size / 1e6:.1f} MB")
+    return path
+
+
+def _evict_response_cache(index, max_bytes, keep=None):
+    """Evict least recently used responses until the cache fits max_bytes"""
+    removed = 0
+    freed = 0
+    total = sum(entry['bytes'] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_access']):
+        if total <= max_bytes:
+            break
+        if key == keep:
+            continue
+        entry = index.pop(key)
+        _response_cache_path(key).unlink(missing_ok=True)
+        record_cache_eviction("responses", entry['bytes'])
+        total -= entry['bytes']
+        freed += entry['bytes']
+        removed += 1
+    if removed:
+        logger.info(f"Evicted {removed} cached responses ({freed / 1e6:.1f} MB)")
+    return removed, freed
+
+
+def inspect_response_cache():
+    """
+    Summarize the response cache
+
+    Returns:
+        dict: Entry count, compressed and raw sizes, age range and the
+        number and size of files the index does not know about
+    """
+    with _response_cache_locked():
+        index = _load_response_cache_index()
+
+    known = {_response_cache_path(key).name for key in index} | {RESPONSE_CACHE_INDEX, RESPONSE_CACHE_LOCK}
+    orphans = [p for p in RESPONSE_CACHE_DIR.iterdir() if p.is_file() and p.name not in known] if RESPONSE_CACHE_DIR.exists() else []
+    created = [entry['created'] for entry in index.values()]
+    return {
+        'entries': len(index),
+        'bytes': sum(entry['bytes'] for entry in index.values()),
+        'raw_bytes': sum(entry['raw_bytes'] for entry in index.values()),
+        'max_bytes': RESPONSE_CACHE_MAX_BYTES,
+        'oldest': min(created, default=None),
+        'newest': max(created, default=None),
+        'orphans': len(orphans),
+        'orphan_bytes': sum(p.stat().st_size for p in orphans),
+    }
+
+
+def prune_response_cache(max_bytes=None, older_than=None):
+    """
+    Remove cached responses by age and then by size
+
+    Args:
+        max_bytes: Evict least recently used responses down to this size
+        older_than: Remove responses created more than this many seconds ago
+
+    Returns:
+        tuple: (responses removed, bytes freed)
+    """
+    removed = 0
+    freed = 0
+    with _response_cache_locked():
+        index = _load_response_cache_index()
+        if older_than is not None:
+            cutoff = time.time() - older_than
+            for key in [k for k, entry in index.items() if entry['created'] < cutoff]:
+                freed += index.pop(key)['bytes']
+                _response_cache_path(key).unlink(missing_ok=True)
+                removed += 1
+        if max_bytes is not None:
+            evicted, evicted_bytes = _evict_response_cache(index, max_bytes)
+            removed += evicted
+            freed += evicted_bytes
+        _save_response_cache_index(index)
+    return removed, freed
+
+
+def compact_response_cache():
+    """
+    Recompress every cached response at the strong level and drop stray files
+
+    Stray files are leftover partial downloads and temporary files in the
+    response cache folder, and index entries whose file is gone. Files touched
+    in the last hour are left alone, since a running server may be writing
+    them.
+
+    Responses are recompressed without holding the index lock, so a running
+    server keeps caching meanwhile; each one is swapped in under the lock
+    only if its entry is still the one that was read.
+
+    Returns:
+        tuple: (bytes before, bytes after)
+    """
+    import shutil
+
+    with _response_cache_locked():
+        index = _load_response_cache_index()
+    before = sum(entry['bytes'] for entry in index.values())
+
+    for key, entry in index.items():
+        path = _response_cache_path(key)
+        try:
+            with tempfile.NamedTemporaryFile(dir=RESPONSE_CACHE_DIR, suffix='.part', delete=False) as raw:
+                raw_path = Path(raw.name)
+                with open_response(path) as source:
+                    shutil.copyfileobj(source, raw, OVERPASS_READ_CHUNK)
+            compressed_path = _compress_to_temp(raw_path, path, RESPONSE_CACHE_COMPACT_LEVEL)
+        except FileNotFoundError:
+            # Evicted meanwhile; the index update below drops it if needed
+            continue
+        finally:
+            raw_path.unlink(missing_ok=True)
+
+        with _response_cache_locked():
+            current = _load_response_cache_index()
+            if current.get(key, {}).get('created') == entry['created'] and path.exists():
+                os.replace(compressed_path, path)
+                current[key]['bytes'] = path.stat().st_size
+                _save_response_cache_index(current)
+            else:
+                compressed_path.unlink(missing_ok=True)
+
+    with _response_cache_locked():
+        index = _load_response_cache_index()
+        for key in [k for k in index if not _response_cache_path(k).exists()]:
+            del index[key]
+
+        known = {_response_cache_path(key).name for key in index} | {RESPONSE_CACHE_INDEX, RESPONSE_CACHE_LOCK}
+        if RESPONSE_CACHE_DIR.exists():
+            for path in RESPONSE_CACHE_DIR.iterdir():
+                if path.is_file() and path.name not in known and time.time() - path.stat().st_mtime > 3600:
+                    path.unlink(missing_ok=True)
+
+        _save_response_cache_index(index)
+        after = sum(entry['bytes'] for entry in index.values())
+
+    return before, after
+
+
+def overpass_request(query, progress=None, timeout=None, attempts=None):
+    """
+    Run an Overpass query through the endpoint pool
+
+    Responses are kept in the managed response cache, keyed on the query
+    alone so a response from any endpoint can be reused. Responses past the
+    soft TTL are downloaded again, so graphs built from them are not born
+    stale. The time each response was downloaded is recorded for
+    fetch_with_snapshot_time.
+
+    Args:
+        query: Overpass QL query string
+        progress: Optional DownloadProgress receiving the bytes downloaded
+        timeout: Seconds to wait for an endpoint; the OSMnx setting if None
+        attempts: Endpoint attempts before giving up; OVERPASS_MAX_ATTEMPTS if None
+
+    Returns:
+        tuple: (Path of the response file for open_response, True if the
+        file is temporary)
+    """
+    start = time.monotonic()
+    requested = time.time()
+    response_times = _response_times.get()
+    if ox.settings.use_cache and not _http_cache_bypass.get():
+        cached = response_cache_get(query, max_age=GRAPH_STORE_SOFT_TTL)
+        if cached is not None:
+            cached_path, created = cached
+            record_cache_hit("responses", time.monotonic() - start)
+            if response_times is not None:
+                response_times.append(created)
+            return cached_path, False
+
+    attempts = attempts or OVERPASS_MAX_ATTEMPTS
+    error = None
+    for attempt in range(1, attempts + 1):
+        try:
+            path = _hedged_request(query, progress, timeout)
+            record_cache_miss("responses", time.monotonic() - start)
+            if response_times is not None:
+                response_times.append(requested)
+            if not ox.settings.use_cache:
+                return path, True
+            return response_cache_put(query, path), False
+        except OverpassRequestError as e:
+            error = e
+            if not e.retryable or attempt == attempts:
+                break
+            backoff = min(OVERPASS_BACKOFF_MAX, OVERPASS_BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+            logger.warning(f"Overpass attempt {attempt}/{attempts} failed ({e}); retrying in {backoff:.0f}s")
+            time.sleep(backoff)
+
+    raise RuntimeError(f"Overpass request failed: {error}")
+
+
+def fetch_with_snapshot_time(fetch, *args):
+    """
+    Run a fetch and tell how old the OSM data it read is
+
+    A fetch served from the response cache holds data as old as the oldest
+    cached response, not the time the fetch ran.
+
+    Args:
+        fetch: Callable running Overpass queries (or reading a local extract)
+        *args: Arguments passed to fetch
+
+    Returns:
+        tuple: (result of fetch, snapshot time of its data)
+    """
+    response_times = []
+    started = time.time()
+    token = _response_times.set(response_times)
+    try:
+        result = fetch(*args)
+    finally:
+        _response_times.reset(token)
+    return result, min(response_times, default=started)
+
+
+# Bytes read from the network or disk per step while streaming a response
+OVERPASS_READ_CHUNK = 1 << 20
+
+_JSON_SEPARATORS = ' \t\r\n,'
+
+
+def iter_json_array_items(stream, key='elements', chunk_size=OVERPASS_READ_CHUNK):
+    """
+    Yield the items of a top-level JSON array one at a time
+
+    Only the current chunk and the item being decoded are held in memory,
+    never the whole document.
+
+    Args:
+        stream: Text stream of a JSON object
+        key: Name of the array member to iterate
+        chunk_size: Characters read per refill
+
+    Yields:
+        Decoded array items
+    """
+    decoder = json.JSONDecoder()
+    marker = f'"{key}"'
+
+    # Skip the header up to the opening bracket of the array
+    buffer = ''
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer += chunk
+        found = buffer.find(marker)
+        bracket = buffer.find('[', found + len(marker)) if found >= 0 else -1
+        if bracket >= 0:
+            pos = bracket + 1
+            break
+        if not chunk:
+            raise ValueError(f"Response has no '{key}' array")
+
+    while True:
+        while pos < len(buffer) and buffer[pos] in _JSON_SEPARATORS:
+            pos += 1
+
+        if pos < len(buffer) and buffer[pos] == ']':
+            return
+
+        try:
+            if pos == len(buffer):
+                raise json.JSONDecodeError("Need more data", buffer, pos)
+            item, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                raise ValueError("Response ended inside the elements array")
+            buffer = buffer[pos:] + chunk
+            pos = 0
+            continue
+
+        yield item
+
+
+def iter_overpass_elements(query, progress=None, timeout=None, attempts=None):
+    """
+    Run an Overpass query and stream its elements
+
+    Args:
+        query: Overpass QL query string
+        progress: Optional DownloadProgress receiving bytes and element counts
+        timeout: Seconds to wait for an endpoint; the OSMnx setting if None
+        attempts: Endpoint attempts before giving up; OVERPASS_MAX_ATTEMPTS if None
+
+    Yields:
+        dict: Overpass elements (nodes and ways) in response order
+    """
+    path, temporary = overpass_request(query, progress, timeout, attempts)
+    try:
+        with io.TextIOWrapper(open_response(path), encoding='utf-8') as f:
+            if not progress:
+                yield from iter_json_array_items(f)
+                return
+
+            progress.set_phase('Parsing')
+            count = 0
+            for element in iter_json_array_items(f):
+                yield element
+                count += 1
+                if count == PROGRESS_ELEMENT_BATCH:
+                    progress.add_elements(count)
+                    count = 0
+            progress.add_elements(count)
+            progress.set_phase('Building graph')
+    finally:
+        if temporary:
+            Path(path).unlink(missing_ok=True)
+
+
+# Query profile: "slim" asks Overpass only for way geometry plus whitelisted
+# tags; "full" returns every tag on every way and node, as OSMnx does
+OVERPASS_QUERY_PROFILE = os.environ.get("OVERPASS_QUERY_PROFILE", "slim")
+
+# Way tags kept by slim queries: the highway class, direction, and the tags
+# the drive/bike/walk filters read
+SLIM_WAY_TAGS = [
+    tag.strip() for tag in os.environ.get(
+        "SLIM_WAY_TAGS", ",".join(['highway', 'oneway', 'junction'] + NETWORK_FILTER_TAGS)
+    ).split(',') if tag.strip()
+]
+
+# Way filter of the major-roads-only downgrade: road classes up to tertiary
+MAJOR_ROAD_FILTER = '["highway"~"^(motorway|trunk|primary|secondary|tertiary)(_link)?$"]["area"!~"yes"]'
+
+
+def build_network_queries(polygon, geometry=False, major_roads_only=False):
+    """
+    Build Overpass queries for the full street network of a polygon
+
+    In the slim profile, ways are output as skeletons (node references or
+    inline geometry, no tags) and a converted copy of each way carries only
+    the SLIM_WAY_TAGS; nodes are output as bare coordinates. The parsers
+    merge the two copies by way ID.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        geometry: Output inline way geometry instead of nodes ("out geom")
+        major_roads_only: Only ask for motorways down to tertiary roads
+
+    Returns:
+        list: Overpass QL query strings, one per sub-polygon
+    """
+    way_filter = MAJOR_ROAD_FILTER if major_roads_only else ox._overpass._get_network_filter("all")
+    overpass_settings = ox._overpass._make_overpass_settings()
+    tag_list = ','.join(f'"{tag}"=t["{tag}"]' for tag in SLIM_WAY_TAGS)
+
+    queries = []
+    for coords in ox._overpass._make_overpass_polygon_coord_strs(polygon):
+        ways = f"way{way_filter}(poly:{coords!r})->.ways;"
+        if OVERPASS_QUERY_PROFILE == "full":
+            output = ".ways out geom;" if geometry else "(.ways;>;);out;"
+        else:
+            output = (
+                (".ways out skel geom qt;" if geometry else ".ways out skel qt;")
+                + f".ways convert way ::id=id(),{tag_list};out;"
+                + ("" if geometry else "node(w.ways);out skel qt;")
+            )
+        queries.append(f"{overpass_settings};{ways}{output}")
+
+    return queries
+
+
+def split_path_on_known_nodes(osmid, refs, node_ids, tags):
+    """
+    Cut a way into runs of consecutive nodes whose locations are known
+
+    A way leaving and re-entering the loaded area never gets a straight
+    edge across the gap.
+
+    Args:
+        osmid: OSM way ID
+        refs: Node IDs of the way
+        node_ids: Sorted numpy array of known node IDs
+        tags: Way tags to copy onto every path
+
+    Returns:
+        list: OSMnx-style path dicts with 'osmid', 'nodes' and tags
+    """
+    refs = np.asarray(refs, dtype=np.int64)
+    if len(node_ids) == 0 or len(refs) == 0:
+        return []
+    positions = np.searchsorted(node_ids, refs)
+    positions[positions == len(node_ids)] = 0
+    known = node_ids[positions] == refs
+
+    paths = []
+    run = []
+    for ref, is_known in zip(refs.tolist(), known.tolist()):
+        if is_known:
+            if not run or run[-1] != ref:
+                run.append(ref)
+            continue
+        if len(run) > 1:
+            paths.append({'osmid': osmid, 'nodes': run, **tags})
+        run = []
+    if len(run) > 1:
+        paths.append({'osmid': osmid, 'nodes': run, **tags})
+    return paths
+
+
+def graph_from_paths(node_ids, lons, lats, paths):
+    """
+    Build an unsimplified MultiDiGraph from node arrays and way paths
+
+    Args:
+        node_ids: Sorted numpy array of node IDs
+        lons: Node longitudes aligned with node_ids
+        lats: Node latitudes aligned with node_ids
+        paths: Path dicts whose nodes are all in node_ids
+
+    Returns:
+        networkx.MultiDiGraph: Graph with 'length' on every edge
+    """
+    used = np.unique(np.fromiter((n for path in paths for n in path['nodes']), dtype=np.int64))
+    positions = np.searchsorted(node_ids, used)
+
+    graph = nx.MultiDiGraph(crs=ox.settings.default_crs)
+    graph.add_nodes_from(
+        (int(n), {'x': float(x), 'y': float(y)})
+        for n, x, y in zip(used, lons[positions], lats[positions])
+    )
+    ox.graph._add_paths(graph, paths, bidirectional=False)
+    return ox.distance.add_edge_lengths(graph)
+
+
+def build_network_graph(elements):
+    """
+    Build an unsimplified graph from a stream of Overpass elements
+
+    Nodes go straight into flat coordinate buffers and ways into path
+    dicts with only the useful tags, so peak memory follows the graph
+    rather than the raw response. Tag-only way copies from slim queries
+    are merged into their skeletons by way ID.
+
+    Args:
+        elements: Iterable of Overpass node and way elements
+
+    Returns:
+        networkx.MultiDiGraph: Unsimplified graph
+    """
+    ids, lons, lats = array('q'), array('d'), array('d')
+    ways = {}
+    useful_tags = set(ox.settings.useful_tags_way)
+
+    for element in elements:
+        element_type = element.get('type')
+        if element_type == 'node':
+            ids.append(element['id'])
+            lons.append(element['lon'])
+            lats.append(element['lat'])
+        elif element_type == 'way':
+            way = ways.setdefault(element['id'], {'tags': {}})
+            if 'nodes' in element:
+                way['nodes'] = element['nodes']
+            # convert emits an empty string for tags the way does not have
+            way['tags'].update(
+                (k, v) for k, v in element.get('tags', {}).items() if k in useful_tags and v != ''
+            )
+
+    if not ways:
+        raise ox._errors.InsufficientResponseError("No data elements in server response")
+
+    node_ids, first = np.unique(np.frombuffer(ids, dtype=np.int64), return_index=True)
+    lons = np.frombuffer(lons, dtype=np.float64)[first]
+    lats = np.frombuffer(lats, dtype=np.float64)[first]
+
+    paths = []
+    for osmid, way in ways.items():
+        paths.extend(split_path_on_known_nodes(osmid, way.get('nodes', []), node_ids, way['tags']))
+    del ways
+
+    if not paths:
+        raise ox._errors.InsufficientResponseError("No streets in server response")
+    return graph_from_paths(node_ids, lons, lats, paths)
+
+
+def fetch_overpass_network(polygon, progress=None):
+    """
+    Fetch the unsimplified full network around a polygon through the endpoint pool
+
+    Mirrors the download step of graph_from_polygon: the polygon is
+    buffered by 500 m so edges crossing its border survive truncation.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        networkx.MultiDiGraph: Unsimplified graph of the buffered polygon
+    """
+    polygon_proj, crs_utm = ox.projection.project_geometry(polygon)
+    polygon_buffered, _ = ox.projection.project_geometry(polygon_proj.buffer(500), crs=crs_utm, to_latlong=True)
+
+    queries = build_network_queries(polygon_buffered)
+    elements = (element for query in queries for element in iter_overpass_elements(query, progress))
+    graph = build_network_graph(elements)
+    return ox.truncate.truncate_graph_polygon(graph, polygon_buffered, truncate_by_edge=True)
+
+
+# Buffers larger than this are fetched as a grid of smaller tile queries
+TILED_FETCH_MIN_AREA_KM2 = 2000
+
+# Rough street density used to size tiles when nothing better is known
+ESTIMATED_EDGES_PER_KM2 = 150
+
+# Target number of unsimplified edges per tile query
+TILE_TARGET_EDGES = 60_000
+
+# Unsimplified edges per OSM street node; most streets are two-way, so
+# each segment becomes two directed edges
+TILE_EDGES_PER_NODE = 2
+
+# Tile download concurrency; each query is retried by overpass_request
+MAX_TILE_WORKERS = 4
+
+
+def polygon_area_km2(polygon):
+    """Return the area of a WGS84 polygon in square kilometers"""
+    polygon_proj, _ = ox.projection.project_geometry(polygon)
+    return polygon_proj.area / 1e6
+
+
+def estimate_tile_size(edges_per_km2=ESTIMATED_EDGES_PER_KM2):
+    """Return the tile side length in meters for a given street density"""
+    return math.sqrt(TILE_TARGET_EDGES / edges_per_km2) * 1000
+
+
+def estimate_street_density(polygon):
+    """
+    Estimate the unsimplified street edges per km² of a polygon
+
+    Uses the same street node count as the memory pre-flight (a cached
+    response by the time a tiled fetch runs), and the fixed density when
+    Overpass cannot count.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+
+    Returns:
+        float: Edges per km²
+    """
+    nodes, source = estimate_street_nodes(polygon)
+    if source == 'density model':
+        return ESTIMATED_EDGES_PER_KM2
+    return max(nodes * TILE_EDGES_PER_NODE / polygon_area_km2(polygon), 1)
+
+
+def split_polygon_into_tiles(polygon, tile_size_m):
+    """
+    Split a WGS84 polygon into square grid tiles
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        tile_size_m: Tile side length in meters
+
+    Returns:
+        list: Tile polygons in WGS84 covering the polygon
+    """
+    from shapely.geometry import box
+
+    polygon_proj, crs_utm = ox.projection.project_geometry(polygon)
+    minx, miny, maxx, maxy = polygon_proj.bounds
+
+    tiles = []
+    for x in np.arange(minx, maxx, tile_size_m):
+        for y in np.arange(miny, maxy, tile_size_m):
+            cell = box(x, y, x + tile_size_m, y + tile_size_m).intersection(polygon_proj)
+            if cell.is_empty or cell.geom_type not in ('Polygon', 'MultiPolygon'):
+                continue
+            tile, _ = ox.projection.project_geometry(cell, crs=crs_utm, to_latlong=True)
+            tiles.append(tile)
+
+    return tiles
+
+
+def _download_tile(tile, progress=None):
+    """Download the unsimplified full network of one tile"""
+    try:
+        return fetch_overpass_network(tile, progress)
+    except ox._errors.InsufficientResponseError:
+        # Tiles over water or empty land have no streets
+        return None
+
+
+def finalize_network_graph(graph, polygon):
+    """
+    Simplify and truncate an unsimplified graph the way graph_from_polygon does
+
+    Args:
+        graph: Unsimplified NetworkX graph covering at least the polygon
+        polygon: Shapely polygon in WGS84 to truncate the result to
+
+    Returns:
+        networkx.MultiDiGraph: Simplified graph of the largest component
+    """
+    graph = ox.truncate.largest_component(graph, strongly=False)
+    graph = ox.simplify_graph(graph, edge_attrs_differ=SIMPLIFY_EDGE_ATTRS_DIFFER)
+
+    # Count streets before truncating so border intersections keep their true count
+    street_counts = ox.stats.count_streets_per_node(graph)
+    graph = ox.truncate.truncate_graph_polygon(graph, polygon, truncate_by_edge=True)
+    graph = ox.truncate.largest_component(graph, strongly=False)
+
+    nx.set_node_attributes(graph, values={n: street_counts[n] for n in graph.nodes}, name="street_count")
+    return graph
+
+
+def stitch_tile_graphs(tile_graphs, polygon):
+    """
+    Stitch unsimplified tile graphs into one simplified graph
+
+    Nodes are keyed by OSM ID, so nodes and edges repeated along tile seams
+    collapse into one when the graphs are composed.
+
+    Args:
+        tile_graphs: List of unsimplified tile graphs
+        polygon: Shapely polygon in WGS84 to truncate the result to
+
+    Returns:
+        networkx.MultiDiGraph: Simplified graph of the whole polygon
+    """
+    return finalize_network_graph(nx.compose_all(tile_graphs), polygon)
+
+
+def download_tiles(tiles, progress=None):
+    """
+    Download unsimplified tile graphs with bounded concurrency
+
+    Args:
+        tiles: List of tile polygons in WGS84
+        progress: Optional DownloadProgress shared by all tiles
+
+    Returns:
+        tuple: (list of non-empty tile graphs, number of tiles that failed)
+    """
+    tile_graphs = []
+    missing_tiles = 0
+    with ThreadPoolExecutor(max_workers=MAX_TILE_WORKERS) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, _download_tile, tile, progress)
+            for tile in tiles
+        ]
+        for future in as_completed(futures):
+            try:
+                tile_graph = future.result()
+            except Exception as e:
+                logger.error(f"Tile download gave up: {str(e)}")
+                missing_tiles += 1
+                continue
+            if tile_graph is not None and len(tile_graph.edges) > 0:
+                tile_graphs.append(tile_graph)
+
+    return tile_graphs, missing_tiles
+
+
+def download_tiled_network(polygon, progress=None):
+    """
+    Download the full network of a large polygon as parallel tiles
+
+    Tiles are sized from the area's street density. Each tile retries on
+    its own. Tiles that still fail are skipped and counted in the graph's
+    'missing_tiles' attribute, so a large city degrades to a partial map
+    instead of failing outright.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        networkx.MultiDiGraph: Simplified graph of the whole polygon
+    """
+    edges_per_km2 = estimate_street_density(polygon)
+    tiles = split_polygon_into_tiles(polygon, estimate_tile_size(edges_per_km2))
+    logger.info(f"Tiled fetch: {len(tiles)} tiles at {edges_per_km2:,.0f} edges/km²")
+
+    tile_graphs, missing_tiles = download_tiles(tiles, progress)
+    if not tile_graphs:
+        raise RuntimeError("No tiles could be downloaded")
+
+    if progress:
+        progress.set_phase('Simplifying graph')
+    graph = stitch_tile_graphs(tile_graphs, polygon)
+    graph.graph['missing_tiles'] = missing_tiles
+    if missing_tiles:
+        logger.warning(f"Tiled fetch finished with {missing_tiles}/{len(tiles)} tiles missing")
+    return graph
+
+
+# A cached inner graph must cover this share of a larger request to be expanded
+INCREMENTAL_MIN_COVERAGE = 0.2
+
+# Number of wedges the ring between two buffers is cut into. Overpass only
+# honors polygon exteriors (and OSMnx takes convex hulls of large queries),
+# so the ring has to be split into narrow, hole-free pieces
+ANNULUS_SECTORS = 16
+
+
+def split_ring_into_sectors(outer, inner, sectors=ANNULUS_SECTORS):
+    """
+    Split the area between two WGS84 polygons into hole-free wedges
+
+    Args:
+        outer: Shapely polygon of the requested area
+        inner: Shapely polygon of the already cached area inside it
+        sectors: Number of wedges
+
+    Returns:
+        list: Wedge polygons in WGS84 covering outer minus inner
+    """
+    from shapely.geometry import Polygon
+
+    outer_proj, crs_utm = ox.projection.project_geometry(outer)
+    inner_proj, _ = ox.projection.project_geometry(inner, to_crs=crs_utm)
+    ring = outer_proj.difference(inner_proj)
+
+    center = inner_proj.centroid
+    minx, miny, maxx, maxy = outer_proj.bounds
+    reach = 2 * max(maxx - minx, maxy - miny)
+
+    pieces = []
+    for i in range(sectors):
+        angles = [2 * math.pi * (i + f) / sectors for f in (0, 0.5, 1)]
+        wedge = Polygon(
+            [(center.x, center.y)]
+            + [(center.x + reach * math.cos(a), center.y + reach * math.sin(a)) for a in angles]
+        )
+        piece = wedge.intersection(ring)
+        if piece.is_empty:
+            continue
+        for part in getattr(piece, 'geoms', [piece]):
+            if part.geom_type == 'Polygon' and part.area > 0:
+                part_latlon, _ = ox.projection.project_geometry(part, crs=crs_utm, to_latlong=True)
+                pieces.append(part_latlon)
+
+    return pieces
+
+
+def expand_network_graph(inner_graph, inner_polygon, polygon, progress=None):
+    """
+    Grow a cached graph to a larger polygon by fetching only the outer ring
+
+    The ring is downloaded as wedges, simplified, then merged on OSM node
+    IDs. Ring edges with both ends inside the cached area are dropped,
+    since the cached graph already draws those streets.
+
+    Args:
+        inner_graph: Simplified graph of inner_polygon
+        inner_polygon: Shapely polygon (WGS84) the cached graph covers
+        polygon: Shapely polygon (WGS84) of the requested, larger area
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        networkx.MultiDiGraph: Simplified graph of the requested area
+    """
+    import shapely
+
+    sectors = split_ring_into_sectors(polygon, inner_polygon)
+    logger.info(f"Incremental fetch: {len(sectors)} ring sectors")
+
+    ring_graphs, missing_tiles = download_tiles(sectors, progress)
+    if not ring_graphs:
+        raise RuntimeError("No ring sectors could be downloaded")
+
+    if progress:
+        progress.set_phase('Simplifying graph')
+    ring_graph = ox.simplify_graph(nx.compose_all(ring_graphs), edge_attrs_differ=SIMPLIFY_EDGE_ATTRS_DIFFER)
+    ring_graph = ox.truncate.truncate_graph_polygon(ring_graph, polygon, truncate_by_edge=True)
+
+    # Seam deduplication: drop ring edges already covered by the cached graph
+    nodes = list(ring_graph.nodes)
+    xs = np.array([ring_graph.nodes[n]['x'] for n in nodes])
+    ys = np.array([ring_graph.nodes[n]['y'] for n in nodes])
+    inside = dict(zip(nodes, shapely.contains_xy(inner_polygon, xs, ys)))
+    duplicates = [
+        (u, v, k) for u, v, k in ring_graph.edges(keys=True)
+        if (inside[u] and inside[v]) or (u in inner_graph and v in inner_graph)
+    ]
+    ring_graph.remove_edges_from(duplicates)
+    ring_graph.remove_nodes_from([n for n in nodes if ring_graph.degree(n) == 0])
+
+    graph = nx.compose(inner_graph, ring_graph)
+    graph = ox.truncate.largest_component(graph, strongly=False)
+
+    street_counts = ox.stats.count_streets_per_node(ring_graph)
+    nx.set_node_attributes(graph, values={n: c for n, c in street_counts.items() if n not in inner_graph}, name="street_count")
+    graph.graph['missing_tiles'] = inner_graph.graph.get('missing_tiles', 0) + missing_tiles
+    return graph
+
+
+# ---- Delta refresh ----
+# A stale graph is patched with only the ways changed since its snapshot.
+# The diff starts this much before the snapshot to cover Overpass replication
+# lag; reapplying a change is harmless
+DELTA_REFRESH = os.environ.get("DELTA_REFRESH", "1") != "0"
+DELTA_SAFETY_MARGIN = 900
+
+# Above this many changed ways a full refetch is cheaper than patching
+DELTA_MAX_CHANGED_WAYS = 5000
+
+
+def build_diff_query(polygon, since):
+    """
+    Build an Overpass augmented-diff query for street ways changed since a time
+
+    Ways are output with geometry so node moves show up as modifications
+    even when the way itself keeps its version.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        since: Unix timestamp to diff against
+
+    Returns:
+        str: Overpass QL query string
+    """
+    way_filter = ox._overpass._get_network_filter("all")
+    overpass_settings = ox._overpass._make_overpass_settings().replace("[out:json]", "[out:xml]")
+    since_iso = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(since))
+    ways = "".join(
+        f"way{way_filter}(poly:{coords!r});"
+        for coords in ox._overpass._make_overpass_polygon_coord_strs(polygon)
+    )
+    return f'{overpass_settings}[adiff:"{since_iso}"];({ways});out skel geom;'
+
+
+def parse_augmented_diff(stream):
+    """
+    Read the changed way IDs from an Overpass augmented diff
+
+    Works on a live response or a recorded diff file alike.
+
+    Args:
+        stream: Binary stream of augmented diff XML
+
+    Returns:
+        tuple: (set of changed way IDs, dict of action counts by type)
+    """
+    import xml.etree.ElementTree as ET
+
+    changed = set()
+    actions = {}
+    for _, element in ET.iterparse(stream, events=('end',)):
+        if element.tag == 'remark' and 'runtime error' in (element.text or ''):
+            raise ValueError(element.text.strip())
+        if element.tag != 'action':
+            continue
+        action_type = element.get('type')
+        actions[action_type] = actions.get(action_type, 0) + 1
+        changed.update(int(way.get('id')) for way in element.iter('way'))
+        element.clear()
+
+    return changed, actions
+
+
+def fetch_changed_ways(polygon, since):
+    """
+    Ask Overpass which street ways in a polygon changed since a time
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        since: Unix timestamp to diff against
+
+    Returns:
+        tuple: (set of changed way IDs, dict of action counts by type)
+    """
+    path, temporary = overpass_request(build_diff_query(polygon, since))
+    try:
+        with open_response(path) as f:
+            return parse_augmented_diff(f)
+    finally:
+        if temporary:
+            Path(path).unlink(missing_ok=True)
+
+
+def fetch_way_elements(way_ids, neighbours=False):
+    """
+    Fetch the current version of street ways by ID
+
+    Args:
+        way_ids: OSM way IDs; deleted or no longer matching ways are skipped
+        neighbours: Also fetch street ways sharing a node with these ways
+
+    Returns:
+        iterator: Overpass node and way elements
+    """
+    way_filter = ox._overpass._get_network_filter("all")
+    overpass_settings = ox._overpass._make_overpass_settings()
+    ways = f"way{way_filter}(id:{','.join(str(i) for i in sorted(way_ids))})->.ways;"
+    if neighbours:
+        ways += f"node(w.ways)->.shared;(.ways;way{way_filter}(bn.shared););->.ways;"
+    return iter_overpass_elements(f"{overpass_settings};{ways}.ways out qt;node(w.ways);out skel qt;")
+
+
+def patch_network_graph(graph, polygon, changed, fetch_elements=fetch_way_elements):
+    """
+    Replace the edges of changed ways in a simplified graph
+
+    Every edge carrying a changed way is removed, together with the edges of
+    ways merged into the same simplified edges and of ways sharing a node
+    with a changed way (a new street may branch off mid-edge). The current
+    versions of all those ways are fetched, truncated and simplified against
+    the untouched rest of the graph. Intersections left with two streets by
+    a deletion stay nodes, so the result can have a few more edges than a
+    fresh download while drawing the same streets.
+
+    Args:
+        graph: Simplified graph to patch in place
+        polygon: Shapely polygon (WGS84) the graph was truncated to
+        changed: Set of changed way IDs
+        fetch_elements: Callable (way_ids, neighbours) returning Overpass
+            elements; swapped for recorded responses when testing offline
+
+    Returns:
+        networkx.MultiDiGraph: The patched graph
+    """
+    # Index edges by every way merged into them
+    way_edges = {}
+    for u, v, k, osmid in graph.edges(keys=True, data='osmid'):
+        for way_id in (osmid if isinstance(osmid, list) else [osmid]):
+            way_edges.setdefault(way_id, []).append((u, v, k))
+
+    elements = list(fetch_elements(changed, neighbours=True))
+    affected = set(changed) | {e['id'] for e in elements if e.get('type') == 'way'}
+
+    # Close over simplified edges: a removed edge takes all of its ways along
+    pending = list(affected)
+    while pending:
+        for u, v, k in way_edges.get(pending.pop(), []):
+            osmid = graph.edges[u, v, k]['osmid']
+            for way_id in (osmid if isinstance(osmid, list) else [osmid]):
+                if way_id not in affected:
+                    affected.add(way_id)
+                    pending.append(way_id)
+
+    partners = affected - changed - {e['id'] for e in elements if e.get('type') == 'way'}
+    if partners:
+        elements.extend(fetch_elements(partners, neighbours=False))
+
+    removed = {edge for way_id in affected for edge in way_edges.get(way_id, [])}
+    touched = {n for u, v, _ in removed for n in (u, v)}
+    graph.remove_edges_from(removed)
+    graph.remove_nodes_from([n for n in list(graph.nodes) if graph.degree(n) == 0])
+
+    added = 0
+    try:
+        patch = build_network_graph(elements)
+    except ox._errors.InsufficientResponseError:
+        patch = None
+    if patch is not None:
+        patch = ox.truncate.truncate_graph_polygon(patch, polygon, truncate_by_edge=True)
+        new_nodes = set(patch.nodes) - set(graph.nodes)
+        touched.update(patch.nodes)
+
+        # Existing nodes stay endpoints so untouched edges keep their geometry
+        nx.set_node_attributes(graph, True, name='_delta_keep')
+        graph.graph['simplified'] = False
+        graph.add_nodes_from((n, patch.nodes[n]) for n in new_nodes)
+        graph.add_edges_from(patch.edges(keys=True, data=True))
+        added = len(patch.edges)
+        graph = ox.simplify_graph(
+            graph, node_attrs_include=['_delta_keep'], edge_attrs_differ=SIMPLIFY_EDGE_ATTRS_DIFFER
+        )
+        for _, data in graph.nodes(data=True):
+            data.pop('_delta_keep', None)
+
+    street_counts = ox.stats.count_streets_per_node(graph, nodes=[n for n in touched if n in graph])
+    nx.set_node_attributes(graph, values=street_counts, name="street_count")
+
+    logger.info(f"Delta patch: {len(changed):,} changed ways, {len(removed):,} edges removed, {added:,} unsimplified edges added")
+    return ox.truncate.largest_component(graph, strongly=False)
+
+
+def delta_refresh_network_graph(graph, polygon):
+    """
+    Bring a stored graph up to date from the changes since its snapshot
+
+    Args:
+        graph: Simplified graph with a 'snapshot_time' graph attribute
+        polygon: Shapely polygon (WGS84) the graph covers
+
+    Returns:
+        networkx.MultiDiGraph or None if a full refetch is needed instead
+    """
+    started = time.time()
+    since = graph.graph['snapshot_time'] - DELTA_SAFETY_MARGIN
+
+    # Same 500 m buffer the full fetch used, so edges crossing the border are seen
+    polygon_proj, crs_utm = ox.projection.project_geometry(polygon)
+    polygon_buffered, _ = ox.projection.project_geometry(polygon_proj.buffer(500), crs=crs_utm, to_latlong=True)
+
+    changed, actions = fetch_changed_ways(polygon_buffered, since)
+    logger.info(f"Augmented diff: {len(changed):,} changed ways {actions}")
+    if len(changed) > DELTA_MAX_CHANGED_WAYS:
+        return None
+
+    if changed:
+        graph = patch_network_graph(graph, polygon, changed)
+    graph.graph['snapshot_time'] = started
+    return graph
+
+
+# Optional local data source: a regional .osm.pbf extract (e.g. from Geofabrik)
+OSM_PBF_PATH = os.environ.get("OSM_PBF_PATH")
+
+# Highway values dropped from the full network, matching the OSMnx 'all' filter
+FULL_NETWORK_EXCLUDED_HIGHWAYS = {
+    'abandoned', 'construction', 'no', 'planned', 'platform', 'proposed',
+    'raceway', 'razed', 'rest_area', 'services'
+}
+
+# Margin kept around the polygon while reading an extract, like graph_from_polygon
+PBF_POLYGON_MARGIN_M = 500
+
+
+def _read_pbf_nodes(osmium, pbf_path, polygon):
+    """
+    Stream node locations inside a polygon from an .osm.pbf extract
+
+    Only nodes in the polygon's bounding box are held, in flat arrays, and
+    the exact polygon test runs vectorized once the file has been read.
+
+    Returns:
+        tuple: (sorted node ids, lon array, lat array) as numpy arrays
+    """
+    import shapely
+
+    minx, miny, maxx, maxy = polygon.bounds
+    ids, lons, lats = array('q'), array('d'), array('d')
+
+    for node in osmium.FileProcessor(pbf_path, osmium.osm.NODE):
+        location = node.location
+        if not location.valid():
+            continue
+        lon, lat = location.lon, location.lat
+        if minx <= lon <= maxx and miny <= lat <= maxy:
+            ids.append(node.id)
+            lons.append(lon)
+            lats.append(lat)
+
+    ids = np.frombuffer(ids, dtype=np.int64)
+    lons = np.frombuffer(lons, dtype=np.float64)
+    lats = np.frombuffer(lats, dtype=np.float64)
+
+    inside = shapely.contains_xy(polygon, lons, lats)
+    ids, lons, lats = ids[inside], lons[inside], lats[inside]
+
+    order = np.argsort(ids)
+    return ids[order], lons[order], lats[order]
+
+
+def _read_pbf_ways(osmium, pbf_path, node_ids):
+    """
+    Stream highway ways that touch the given nodes from an .osm.pbf extract
+
+    Ways are cut into runs of consecutive known nodes with
+    split_path_on_known_nodes.
+
+    Returns:
+        list: OSMnx-style path dicts with 'osmid', 'nodes' and way tags
+    """
+    paths = []
+    useful_tags = ox.settings.useful_tags_way
+
+    ways = osmium.FileProcessor(pbf_path, osmium.osm.WAY).with_filter(osmium.filter.KeyFilter('highway'))
+    for way in ways:
+        tags = way.tags
+        if tags.get('highway') in FULL_NETWORK_EXCLUDED_HIGHWAYS or tags.get('area') == 'yes':
+            continue
+
+        refs = [n.ref for n in way.nodes]
+        path_tags = {tag: tags[tag] for tag in useful_tags if tag in tags}
+        paths.extend(split_path_on_known_nodes(way.id, refs, node_ids, path_tags))
+
+    return paths
+
+
+def load_pbf_network(pbf_path, polygon):
+    """
+    Build the full network of a polygon from a local .osm.pbf extract
+
+    The extract is streamed twice (nodes, then highway ways), so memory
+    scales with the area of the polygon rather than the size of the file.
+    The result matches what graph_from_polygon returns for network_type 'all'.
+
+    Args:
+        pbf_path: Path to the .osm.pbf extract
+        polygon: Shapely polygon in WGS84
+
+    Returns:
+        networkx.MultiDiGraph: Simplified graph of the polygon
+    """
+    try:
+        import osmium
+    except ImportError:
+        raise RuntimeError("Reading .osm.pbf extracts requires the 'osmium' package (pip install osmium)")
+
+    if not os.path.exists(pbf_path):
+        raise FileNotFoundError(f"OSM extract not found: {pbf_path}")
+
+    # Read a margin around the polygon so edges crossing the border survive truncation
+    polygon_proj, crs_utm = ox.projection.project_geometry(polygon)
+    read_area, _ = ox.projection.project_geometry(
+        polygon_proj.buffer(PBF_POLYGON_MARGIN_M), crs=crs_utm, to_latlong=True
+    )
+
+    node_ids, lons, lats = _read_pbf_nodes(osmium, pbf_path, read_area)
+    paths = _read_pbf_ways(osmium, pbf_path, node_ids)
+    if not paths:
+        raise ValueError("No streets found in the OSM extract for this area")
+
+    graph = graph_from_paths(node_ids, lons, lats, paths)
+
+    logger.info(f"Read {len(paths):,} ways from {pbf_path}")
+    return finalize_network_graph(graph, polygon)
+
+
+# ---- Persistent graph store ----
+# Full network graphs are kept on disk as Arrow IPC (Feather) files, so they
+# survive restarts. Hits are memory-mapped and drawn from their columns,
+# with no graph rebuilt (see stored_street_lines)
+GRAPH_STORE_DIR = Path(os.environ.get("GRAPH_STORE_DIR", "graph_store"))
+GRAPH_STORE_MAX_BYTES = int(os.environ.get("GRAPH_STORE_MAX_BYTES", 2 * 1024 ** 3))
+# Graphs older than the soft TTL are still served but refreshed in the
+# background; past the hard TTL (max age) they are dropped
+GRAPH_STORE_SOFT_TTL = int(os.environ.get("GRAPH_STORE_SOFT_TTL", 3600))
+GRAPH_STORE_MAX_AGE = int(os.environ.get("GRAPH_STORE_MAX_AGE", 86400))
+
+# Part of every store key and source identifier; bumped when stored graphs
+# are built differently, so older entries are neither served nor clipped
+GRAPH_STORE_VERSION = 3
+
+_graph_store_lock = threading.RLock()
+
+
+def request_cache_key(request_key, *parts):
+    """
+    Build a cache key from a canonical request key
+
+    Args:
+        request_key: The 'key' string from canonical_request
+        *parts: Extra values that distinguish the cached data (e.g. source)
+
+    Returns:
+        str: Hex digest usable as a file name
+    """
+    digest = hashlib.sha256(request_key.encode())
+    for part in parts:
+        digest.update(repr(part).encode())
+    return digest.hexdigest()[:32]
+
+
+def polygon_cache_key(polygon_wkt, *parts):
+    """
+    Build a canonical cache key for a polygon
+
+    The polygon is normalized and snapped to ~10 cm precision before
+    hashing, so equivalent WKT strings map to the same key.
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        *parts: Extra values that distinguish the cached data (e.g. source)
+
+    Returns:
+        str: Hex digest usable as a file name
+    """
+    import shapely
+    from shapely import wkt
+
+    polygon = shapely.normalize(shapely.set_precision(wkt.loads(polygon_wkt), 1e-6))
+    digest = hashlib.sha256(polygon.wkb)
+    for part in parts:
+        digest.update(repr(part).encode())
+    return digest.hexdigest()[:32]
+
+
+def _load_graph_store_index():
+    """Read the graph store index (key -> entry metadata)"""
+    index_path = GRAPH_STORE_DIR / "index.json"
+    if not index_path.exists():
+        return {}
+    try:
+        return json.loads(index_path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Graph store index unreadable, starting fresh: {e}")
+        return {}
+
+
+def _save_graph_store_index(index):
+    """Atomically write the graph store index"""
+    GRAPH_STORE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = GRAPH_STORE_DIR / "index.json.tmp"
+    tmp_path.write_text(json.dumps(index))
+    os.replace(tmp_path, GRAPH_STORE_DIR / "index.json")
+
+
+def _records_to_table(ids, records, id_columns):
+    """
+    Convert attribute dicts to an Arrow table
+
+    Geometries become WKB. Columns holding lists or mixed types (e.g. a
+    simplified edge's list of highway values) are stored as JSON strings.
+
+    Returns:
+        tuple: (pyarrow.Table, list of JSON-encoded column names)
+    """
+    import pyarrow as pa
+    import shapely
+
+    columns = {name: pa.array(values, type=pa.int64()) for name, values in zip(id_columns, ids)}
+    encoded = []
+
+    keys = sorted({key for record in records for key in record})
+    for key in keys:
+        values = [record.get(key) for record in records]
+        if key == 'geometry':
+            columns[key] = pa.array(shapely.to_wkb(values), type=pa.binary())
+            continue
+        try:
+            if any(isinstance(v, (list, dict, set)) for v in values):
+                raise TypeError("nested values")
+            columns[key] = pa.array(values)
+        except (TypeError, ValueError, pa.ArrowException):
+            columns[key] = pa.array([None if v is None else json.dumps(v, default=list) for v in values], type=pa.string())
+            encoded.append(key)
+
+    return pa.table(columns), encoded
+
+
+def _table_to_records(table, id_columns, encoded):
+    """Convert an Arrow table back to (ids, attribute dicts)"""
+    import shapely
+
+    ids = [table.column(name).to_numpy().tolist() for name in id_columns]
+    attr_names = [name for name in table.column_names if name not in id_columns]
+
+    columns = []
+    for name in attr_names:
+        values = table.column(name).to_pylist()
+        if name == 'geometry':
+            values = shapely.from_wkb(values).tolist()
+        elif name in encoded:
+            values = [None if v is None else json.loads(v) for v in values]
+        columns.append(values)
+
+    records = [
+        {name: value for name, value in zip(attr_names, row) if value is not None}
+        for row in zip(*columns)
+    ] if columns else [{} for _ in range(table.num_rows)]
+    return ids, records
+
+
+def graph_store_put(key, graph, polygon_wkt=None, source=None):
+    """
+    Write a graph to the persistent store and evict old entries
+
+    Args:
+        key: Cache key from request_cache_key or polygon_cache_key
+        graph: NetworkX MultiDiGraph to store
+        polygon_wkt: Polygon the graph covers, used for containment lookups
+        source: JSON-serializable data source identifier
+    """
+    import pyarrow.feather as feather
+
+    node_ids, node_records = zip(*graph.nodes(data=True)) if len(graph) else ((), ())
+    edges = list(graph.edges(keys=True, data=True))
+    edge_ids = [[e[0] for e in edges], [e[1] for e in edges], [e[2] for e in edges]]
+    edge_records = [e[3] for e in edges]
+
+    nodes_table, nodes_encoded = _records_to_table([list(node_ids)], list(node_records), ['osmid'])
+    edges_table, edges_encoded = _records_to_table(edge_ids, edge_records, ['u', 'v', 'key'])
+
+    with _graph_store_lock:
+        GRAPH_STORE_DIR.mkdir(parents=True, exist_ok=True)
+        nodes_path = GRAPH_STORE_DIR / f"{key}.nodes.arrow"
+        edges_path = GRAPH_STORE_DIR / f"{key}.edges.arrow"
+        feather.write_feather(nodes_table, nodes_path, compression='uncompressed')
+        feather.write_feather(edges_table, edges_path, compression='uncompressed')
+
+        index = _load_graph_store_index()
+        now = time.time()
+        index[key] = {
+            'bytes': nodes_path.stat().st_size + edges_path.stat().st_size,
+            'created': graph.graph.get('snapshot_time', now),
+            'last_access': now,
+            'graph': json.loads(json.dumps(graph.graph, default=str)),
+            'polygon': polygon_wkt,
+            'source': source,
+            'node_count': len(graph.nodes),
+            'nodes_encoded': nodes_encoded,
+            'edges_encoded': edges_encoded,
+        }
+        record_cache_store("graph_store", index[key]['bytes'])
+        _evict_graph_store(index)
+        _save_graph_store_index(index)
+
+    logger.info(f"Stored graph {key} ({index.get(key, {}).get('bytes', 0) / 1e6:.1f} MB)")
+
+
+def graph_store_read(key):
+    """
+    Memory-map the node and edge tables of a stored graph
+
+    Args:
+        key: Cache key from request_cache_key or polygon_cache_key
+
+    Returns:
+        tuple or None: (index entry, nodes table, edges table), or None if
+        missing, expired or unreadable
+    """
+    import pyarrow as pa
+
+    with _graph_store_lock:
+        index = _load_graph_store_index()
+        entry = index.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry['created'] > GRAPH_STORE_MAX_AGE:
+            _remove_graph_store_entry(index, key)
+            _save_graph_store_index(index)
+            return None
+
+        try:
+            tables = []
+            for part in ('nodes', 'edges'):
+                with pa.memory_map(str(GRAPH_STORE_DIR / f"{key}.{part}.arrow")) as source:
+                    tables.append(pa.ipc.open_file(source).read_all())
+        except (OSError, pa.ArrowException) as e:
+            logger.warning(f"Graph store entry {key} unreadable: {e}")
+            _remove_graph_store_entry(index, key)
+            _save_graph_store_index(index)
+            return None
+
+        entry['last_access'] = time.time()
+        _save_graph_store_index(index)
+
+    return entry, tables[0], tables[1]
+
+
+def graph_store_get(key):
+    """
+    Load a graph from the persistent store
+
+    Every attribute is converted back to Python objects, which is slow for
+    large graphs; drawing reads the tables through stored_street_lines
+    instead, and only refreshes, clipping and expansion need the graph.
+
+    Args:
+        key: Cache key from request_cache_key or polygon_cache_key
+
+    Returns:
+        networkx.MultiDiGraph or None if missing or expired
+    """
+    stored = graph_store_read(key)
+    if stored is None:
+        return None
+    entry, nodes_table, edges_table = stored
+
+    (node_ids,), node_records = _table_to_records(nodes_table, ['osmid'], entry['nodes_encoded'])
+    (us, vs, keys), edge_records = _table_to_records(edges_table, ['u', 'v', 'key'], entry['edges_encoded'])
+
+    graph = nx.MultiDiGraph(**entry['graph'])
+    graph.add_nodes_from(zip(node_ids, node_records))
+    graph.add_edges_from(zip(us, vs, keys, edge_records))
+    return graph
+
+
+def graph_store_find_containing(polygon_wkt, source=None):
+    """
+    Find a stored graph whose polygon contains the given polygon
+
+    Args:
+        polygon_wkt: Well-Known Text representation of the wanted polygon
+        source: Data source identifier the stored graph must match
+
+    Returns:
+        str or None: Key of the smallest containing graph
+    """
+    from shapely import wkt
+
+    polygon = wkt.loads(polygon_wkt)
+    with _graph_store_lock:
+        index = _load_graph_store_index()
+
+    now = time.time()
+    candidates = []
+    for key, entry in index.items():
+        if entry.get('polygon') is None or entry.get('source') != source:
+            continue
+        if now - entry['created'] > GRAPH_STORE_MAX_AGE:
+            continue
+        stored_polygon = wkt.loads(entry['polygon'])
+        if stored_polygon.contains(polygon):
+            candidates.append((stored_polygon.area, key))
+
+    return min(candidates)[1] if candidates else None
+
+
+def graph_store_find_contained(polygon_wkt, source=None):
+    """
+    Find the largest stored graph whose polygon lies inside the given polygon
+
+    Args:
+        polygon_wkt: Well-Known Text representation of the wanted polygon
+        source: Data source identifier the stored graph must match
+
+    Returns:
+        tuple: (key, stored polygon WKT) or (None, None)
+    """
+    from shapely import wkt
+
+    polygon = wkt.loads(polygon_wkt)
+    with _graph_store_lock:
+        index = _load_graph_store_index()
+
+    now = time.time()
+    best = (0, None, None)
+    for key, entry in index.items():
+        if entry.get('polygon') is None or entry.get('source') != source:
+            continue
+        if now - entry['created'] > GRAPH_STORE_MAX_AGE:
+            continue
+        stored_polygon = wkt.loads(entry['polygon'])
+        if stored_polygon.area > best[0] and polygon.contains(stored_polygon):
+            best = (stored_polygon.area, key, entry['polygon'])
+
+    return best[1], best[2]
+
+
+def _remove_graph_store_entry(index, key):
+    """Delete a graph store entry's files and index record"""
+    index.pop(key, None)
+    for part in ('nodes', 'edges'):
+        path = GRAPH_STORE_DIR / f"{key}.{part}.arrow"
+        if path.exists():
+            path.unlink()
+
+
+def _evict_graph_store(index):
+    """Evict least recently used entries until the store fits its byte cap"""
+    total = sum(entry['bytes'] for entry in index.values())
+    for key in sorted(index, key=lambda k: index[k]['last_access']):
+        if total <= GRAPH_STORE_MAX_BYTES:
+            break
+        total -= index[key]['bytes']
+        record_cache_eviction("graph_store", index[key]['bytes'])
+        _remove_graph_store_entry(index, key)
+        logger.info(f"Evicted graph {key} from store")
+
+
+# ---- Shared in-memory graph cache ----
+# Graphs served to sessions are frozen and shared by reference, so any number
+# of sessions viewing a city hold one copy and a hit costs no deserialization.
+# Street line stores built from them are shared the same way.
+# Entries in use are pinned by a reference count; only unused ones are evicted
+SHARED_GRAPH_CACHE_MAX_BYTES = int(os.environ.get("SHARED_GRAPH_CACHE_MAX_BYTES", 1024 ** 3))
+
+# Rough in-memory footprint of graph elements, for the cache budget
+SHARED_GRAPH_NODE_BYTES = 500
+SHARED_GRAPH_EDGE_BYTES = 1200
+SHARED_GRAPH_COORD_BYTES = 16
+
+_shared_graphs = {}
+_shared_graphs_lock = threading.Lock()
+
+
+def network_store_key(polygon_wkt, pbf_path=None, request_key=None):
+    """
+    Build the graph store key of a full network request
+
+    A rebuilt extract must not be served from an older snapshot, so the
+    extract's modification time is part of the key, as is the store format
+    version.
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        pbf_path: Optional local .osm.pbf extract
+        request_key: Canonical request key; the polygon is hashed if omitted
+
+    Returns:
+        tuple: (store key, source identifier)
+    """
+    pbf_version = os.path.getmtime(pbf_path) if pbf_path and os.path.exists(pbf_path) else None
+    source = [pbf_path, pbf_version, GRAPH_STORE_VERSION]
+    if request_key:
+        key = request_cache_key(request_key, *source)
+    else:
+        key = polygon_cache_key(polygon_wkt, *source)
+    return key, source
+
+
+def estimate_graph_bytes(graph):
+    """Estimate the memory held by a graph and its edge geometries"""
+    import shapely
+
+    geometries = [geometry for _, _, geometry in graph.edges(data='geometry') if geometry is not None]
+    coords = int(shapely.get_num_coordinates(geometries).sum()) if geometries else 0
+    return (
+        len(graph.nodes) * SHARED_GRAPH_NODE_BYTES
+        + len(graph.edges) * SHARED_GRAPH_EDGE_BYTES
+        + coords * SHARED_GRAPH_COORD_BYTES
+    )
+
+
+def _shared_snapshot_time(value):
+    """Return the snapshot time of a shared graph or street lines dict"""
+    if isinstance(value, dict):
+        return value.get('snapshot_time')
+    return value.graph.get('snapshot_time')
+
+
+def shared_graph_acquire(key):
+    """
+    Take a reference to a cached shared graph
+
+    Args:
+        key: (store key, network type or None for the full network), or
+            a street_lines_key
+
+    Returns:
+        networkx.MultiDiGraph, dict or None: Frozen graph or street lines;
+        pass it to release_shared_graph when done
+    """
+    with _shared_graphs_lock:
+        entry = _shared_graphs.get(key)
+        if entry is None:
+            return None
+        snapshot_time = _shared_snapshot_time(entry['graph'])
+        if snapshot_time is not None and time.time() - snapshot_time > GRAPH_STORE_MAX_AGE:
+            del _shared_graphs[key]
+            return None
+        entry['refs'] += 1
+        entry['last_access'] = time.monotonic()
+        return entry['graph']
+
+
+def shared_graph_put(key, graph):
+    """
+    Freeze a graph, cache it for sharing and take a reference to it
+
+    Args:
+        key: (store key, network type or None for the full network), or
+            a street_lines_key
+        graph: Graph or street lines dict no longer modified by anyone
+
+    Returns:
+        networkx.MultiDiGraph or dict: The frozen graph or street lines
+    """
+    if isinstance(graph, dict):
+        freeze_street_lines(graph)
+        size = street_lines_bytes(graph)
+    else:
+        graph = nx.freeze(graph)
+        size = estimate_graph_bytes(graph)
+    with _shared_graphs_lock:
+        _shared_graphs[key] = {'graph': graph, 'bytes': size, 'refs': 1, 'last_access': time.monotonic()}
+        record_cache_store("network", size)
+
+        total = sum(entry['bytes'] for entry in _shared_graphs.values())
+        unused = sorted((k for k, entry in _shared_graphs.items() if entry['refs'] == 0),
+                        key=lambda k: _shared_graphs[k]['last_access'])
+        for evict_key in unused:
+            if total <= SHARED_GRAPH_CACHE_MAX_BYTES:
+                break
+            evicted_bytes = _shared_graphs.pop(evict_key)['bytes']
+            total -= evicted_bytes
+            record_cache_eviction("network", evicted_bytes)
+            logger.info(f"Evicted shared graph {evict_key}")
+
+    if total > SHARED_GRAPH_CACHE_MAX_BYTES:
+        logger.warning(f"Shared graph cache over budget: {total / 1e6:.0f} MB held by graphs in use")
+    return graph
+
+
+def release_shared_graph(graph):
+    """Drop a reference taken by shared_graph_acquire or shared_graph_put"""
+    with _shared_graphs_lock:
+        for entry in _shared_graphs.values():
+            if entry['graph'] is graph:
+                entry['refs'] = max(0, entry['refs'] - 1)
+                return
+
+
+def shared_graph_invalidate(store_key):
+    """
+    Drop the full network and every derived network of a store key
+
+    Sessions holding references keep their graph; new requests miss.
+    """
+    with _shared_graphs_lock:
+        for key in [k for k in _shared_graphs if k[0] == store_key]:
+            del _shared_graphs[key]
+
+
+def clip_network_graph(graph, polygon):
+    """
+    Clip a larger simplified graph to a polygon it contains
+
+    Street counts are kept from the larger graph, which matches how
+    graph_from_polygon counts streets leaving the polygon.
+
+    Args:
+        graph: Simplified NetworkX graph covering the polygon
+        polygon: Shapely polygon in WGS84
+
+    Returns:
+        networkx.MultiDiGraph: Largest connected component inside the polygon
+    """
+    graph = ox.truncate.truncate_graph_polygon(graph, polygon, truncate_by_edge=True)
+    return ox.truncate.largest_component(graph, strongly=False)
+
+
+def _store_network_graph(key, graph, polygon_wkt, source):
+    """
+    Prune a new full network graph and put it in the graph store
+
+    The graph is pruned in place before it is stored or shared, so no cache
+    holds attributes the drive, bike and walk networks never draw. A
+    failing store never fails the request.
+    """
+    freed = prune_graph_attributes(graph)
+    logger.info(f"Pruned full network attributes: {freed / 1e6:.1f} MB freed")
+    try:
+        graph_store_put(key, graph, polygon_wkt, source)
+    except Exception as e:
+        logger.warning(f"Could not store graph: {str(e)}")
+
+
+def fetch_full_network(polygon, pbf_path=None, progress=None):
+    """
+    Build a fresh full network graph, bypassing the graph store
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        pbf_path: Optional local .osm.pbf extract to read instead of Overpass
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        networkx.MultiDiGraph: Simplified full network graph
+    """
+    # Also reached from background refreshes, before any request configured OSMnx
+    configure_osmnx()
+    if pbf_path:
+        if progress:
+            progress.set_phase('Building graph')
+        return load_pbf_network(pbf_path, polygon)
+    if polygon_area_km2(polygon) > TILED_FETCH_MIN_AREA_KM2:
+        return download_tiled_network(polygon, progress)
+
+    graph = fetch_overpass_network(polygon, progress)
+    if progress:
+        progress.set_phase('Simplifying graph')
+    return finalize_network_graph(graph, polygon)
+
+
+# ---- Background refresh ----
+# Stale graphs are served immediately and replaced by a refresh running on a
+# small pool, so a refresh never holds up a page load
+MAX_REFRESH_WORKERS = int(os.environ.get("MAX_REFRESH_WORKERS", 1))
+
+_refresh_executor = ThreadPoolExecutor(max_workers=MAX_REFRESH_WORKERS, thread_name_prefix="graph-refresh")
+
+# Pool replacing the refresh pool for the current context, as _overpass_pool
+_refresh_pool = contextvars.ContextVar("refresh_pool", default=None)
+
+# Store keys with a refresh in flight, so a stale graph is only refreshed once
+# at a time; keys are removed when their refresh finishes
+_refreshing_keys = set()
+_refreshing_keys_lock = threading.Lock()
+
+
+def _claim_refresh(key):
+    """Mark a store key as being refreshed; False if a refresh is in flight"""
+    with _refreshing_keys_lock:
+        if key in _refreshing_keys:
+            return False
+        _refreshing_keys.add(key)
+        return True
+
+
+def _finish_refresh(key):
+    """Clear the mark set by _claim_refresh"""
+    with _refreshing_keys_lock:
+        _refreshing_keys.discard(key)
+
+
+def refresh_network_graph(key, polygon_wkt, request_key=None):
+    """
+    Refetch a stored graph from Overpass and replace the store entry
+
+    Runs on the refresh pool. The stored graph is patched with the ways
+    changed since its snapshot when possible, and refetched in full
+    otherwise. Cached HTTP responses are skipped, since they are as old
+    as the graph being replaced.
+
+    Args:
+        key: Graph store key to replace
+        polygon_wkt: Well-Known Text representation of the stored polygon
+        request_key: Canonical request key of the stored graph
+    """
+    from shapely import wkt
+
+    start = time.monotonic()
+    bypass = _http_cache_bypass.set(True)
+    try:
+        configure_osmnx()
+        polygon = wkt.loads(polygon_wkt)
+        graph = None
+        if DELTA_REFRESH:
+            stored = graph_store_get(key)
+            if stored is not None and 'snapshot_time' in stored.graph:
+                try:
+                    graph = delta_refresh_network_graph(stored, polygon)
+                except Exception as e:
+                    logger.warning(f"Delta refresh of {key} failed, refetching in full: {str(e)}")
+        if graph is None:
+            graph, snapshot_time = fetch_with_snapshot_time(fetch_full_network, polygon)
+            graph.graph['snapshot_time'] = snapshot_time
+        graph.graph['request_key'] = request_key
+        _store_network_graph(key, graph, polygon_wkt, [None, None, GRAPH_STORE_VERSION])
+        shared_graph_invalidate(key)
+        logger.info(f"Refreshed graph {key} in {time.monotonic() - start:.1f}s: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+    except Exception as e:
+        # The stale graph keeps being served until the hard TTL
+        logger.warning(f"Background refresh of {key} failed: {str(e)}")
+    finally:
+        _http_cache_bypass.reset(bypass)
+        _finish_refresh(key)
+
+
+def refresh_if_stale(key, snapshot_time, polygon_wkt, pbf_path=None, request_key=None):
+    """
+    Schedule a background refresh of a served graph past its soft TTL
+
+    Graphs read from a local extract are never refreshed; a rebuilt
+    extract already changes the store key.
+
+    Args:
+        key: Graph store key the graph was served from
+        snapshot_time: Download time of the served graph or street lines
+        polygon_wkt: Well-Known Text representation of the graph's polygon
+        pbf_path: Local .osm.pbf extract the graph was read from, if any
+        request_key: Canonical request key of the graph
+
+    Returns:
+        bool: True if a refresh was scheduled
+    """
+    if pbf_path or snapshot_time is None or time.time() - snapshot_time <= GRAPH_STORE_SOFT_TTL:
+        return False
+
+    # Cleared when the refresh finishes; a refresh already in flight wins
+    if not _claim_refresh(key):
+        return False
+
+    logger.info(f"Graph {key} is {(time.time() - snapshot_time) / 60:.0f} min old; refreshing in the background")
+    executor = _refresh_pool.get() or _refresh_executor
+    try:
+        executor.submit(contextvars.copy_context().run, refresh_network_graph, key, polygon_wkt, request_key)
+    except RuntimeError:
+        # The pool is shut down at interpreter exit
+        _finish_refresh(key)
+        return False
+    return True
+
+
+# Download the full OSM network once per polygon
+def download_full_network(polygon_wkt, pbf_path=None, request_key=None, progress=None):
+    """
+    Download the full OSM street network for given polygon
+
+    The drive, bike and walk networks are all derived from this graph, so
+    each polygon is only fetched and simplified once. Results are kept in
+    the persistent graph store; graphs past the soft TTL are returned as
+    they are and refreshed in the background. The returned graph is frozen
+    and shared; release it with release_shared_graph.
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        pbf_path: Optional local .osm.pbf extract to read instead of Overpass
+        request_key: Canonical request key; the polygon is hashed if omitted
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        tuple: (success, graph_or_error_message)
+    """
+    try:
+        from shapely import wkt
+
+        key, source = network_store_key(polygon_wkt, pbf_path, request_key)
+        graph = shared_graph_acquire((key, None))
+        start = time.monotonic()
+        if graph is None:
+            graph = graph_store_get(key)
+            if graph is not None:
+                logger.info(f"Graph store hit: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+                record_cache_hit("graph_store", time.monotonic() - start)
+                graph = shared_graph_put((key, None), graph)
+        if graph is not None:
+            refresh_if_stale(key, graph.graph.get('snapshot_time'), polygon_wkt, pbf_path, request_key)
+            return True, graph
+
+        polygon = wkt.loads(polygon_wkt)
+
+        # A cached graph of a larger area (e.g. a bigger radius) can be clipped locally
+        containing_key = graph_store_find_containing(polygon_wkt, source)
+        containing_graph = graph_store_get(containing_key) if containing_key else None
+        if containing_graph is not None:
+            graph = clip_network_graph(containing_graph, polygon)
+            graph.graph['request_key'] = request_key
+            logger.info(f"Clipped cached graph {containing_key}: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+            _store_network_graph(key, graph, polygon_wkt, source)
+            record_cache_miss("graph_store", time.monotonic() - start)
+            refresh_if_stale(key, graph.graph.get('snapshot_time'), polygon_wkt, pbf_path, request_key)
+            return True, shared_graph_put((key, None), graph)
+
+        configure_osmnx()
+
+        # A cached graph of a smaller area only needs the surrounding ring fetched
+        if not pbf_path:
+            inner_key, inner_wkt = graph_store_find_contained(polygon_wkt, source)
+            if inner_key and wkt.loads(inner_wkt).area >= INCREMENTAL_MIN_COVERAGE * polygon.area:
+                inner_graph = graph_store_get(inner_key)
+                if inner_graph is not None:
+                    graph = expand_network_graph(inner_graph, wkt.loads(inner_wkt), polygon, progress)
+                    graph.graph['request_key'] = request_key
+                    logger.info(f"Expanded cached graph {inner_key}: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+                    _store_network_graph(key, graph, polygon_wkt, source)
+                    record_cache_miss("graph_store", time.monotonic() - start)
+                    return True, shared_graph_put((key, None), graph)
+
+        graph, snapshot_time = fetch_with_snapshot_time(fetch_full_network, polygon, pbf_path, progress)
+        graph.graph['request_key'] = request_key
+        graph.graph['snapshot_time'] = snapshot_time
+        logger.info(f"Downloaded full network: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+        if progress:
+            progress.set_phase('Storing graph')
+        _store_network_graph(key, graph, polygon_wkt, source)
+        record_cache_miss("graph_store", time.monotonic() - start)
+        return True, shared_graph_put((key, None), graph)
+
+    except Exception as e:
+        logger.error(f"Network download error: {str(e)}")
+        return False, f"Error downloading network: {str(e)}"
+
+# One lock per polygon so concurrent network downloads share a single fetch
+# Entries are [lock, holders and waiters] and are removed once nobody uses them
+_full_network_locks = {}
+_full_network_locks_guard = threading.Lock()
+
+
+@contextmanager
+def _full_network_lock(cache_key, pbf_path=None):
+    """Hold the lock guarding the full network download of a request"""
+    key = (cache_key, pbf_path)
+    with _full_network_locks_guard:
+        entry = _full_network_locks.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _full_network_locks_guard:
+            entry[1] -= 1
+            if not entry[1]:
+                del _full_network_locks[key]
+
+# Get one network type for a polygon
+def download_osm_network(polygon_wkt, network_type, pbf_path=None, request_key=None, progress=None):
+    """
+    Get OSM network data of one type for given polygon
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        network_type: Type of network ('drive', 'bike', 'walk', 'all')
+        pbf_path: Optional local .osm.pbf extract to read instead of Overpass
+        request_key: Canonical request key; the polygon is hashed if omitted
+        progress: Optional DownloadProgress for this request
+
+    Returns:
+        tuple: (success, graph_or_error_message); a returned graph is frozen
+        and shared, release it with release_shared_graph
+    """
+    start = time.monotonic()
+    key, _ = network_store_key(polygon_wkt, pbf_path, request_key)
+    graph = shared_graph_acquire((key, network_type))
+    if graph is not None:
+        logger.info(f"Shared cache hit: {network_type} network")
+        refresh_if_stale(key, graph.graph.get('snapshot_time'), polygon_wkt, pbf_path, request_key)
+        record_cache_hit("network", time.monotonic() - start)
+        return True, graph
+
+    with _full_network_lock(request_key or polygon_wkt, pbf_path):
+        success, result = download_full_network(polygon_wkt, pbf_path, request_key, progress)
+    if not success:
+        return False, result
+    if network_type == 'all':
+        return True, result
+
+    if progress:
+        progress.set_phase('Extracting networks')
+
+    try:
+        graph = extract_network(result, network_type)
+        if len(graph.edges) == 0:
+            return False, f"No {network_type} network found in this area"
+
+        logger.info(f"Extracted {network_type} network: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
+
+        record_cache_miss("network", time.monotonic() - start)
+        return True, shared_graph_put((key, network_type), graph)
+
+    except Exception as e:
+        logger.error(f"Network extraction error: {str(e)}")
+        return False, f"Error extracting {network_type} network: {str(e)}"
+
+    finally:
+        release_shared_graph(result)
+
+# Display labels for each network type, in map label order
+NETWORK_LABELS = {
+    'drive': 'Drive',
+    'bike': 'Bike',
+    'walk': 'Walk',
+}
+
+# Upper bound on concurrent network downloads
+MAX_DOWNLOAD_WORKERS = 3
+
+# Download several network types concurrently
+def download_networks(polygon_wkt, network_types, on_complete=None, pbf_path=None, request_key=None,
+                      progress=None, on_progress=None):
+    """
+    Download network types in parallel with a bounded thread pool
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        network_types: List of network types ('drive', 'bike', 'walk')
+        on_complete: Optional callback(network_type, success, result, done, total)
+            called from the calling thread as each download finishes
+        pbf_path: Optional local .osm.pbf extract to read instead of Overpass
+        request_key: Canonical request key; the polygon is hashed if omitted
+        progress: Optional DownloadProgress the downloads report into
+        on_progress: Optional callback(snapshot) called from the calling
+            thread while the downloads run
+
+    Returns:
+        dict: network_type -> (success, graph_or_error_message)
+    """
+    results = {}
+    total = len(network_types)
+    if total == 0:
+        return results
+
+    # Worker threads need the script context to use Streamlit caches
+    ctx = get_script_run_ctx()
+    workers = min(MAX_DOWNLOAD_WORKERS, total)
+    futures = {}
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers, initializer=partial(add_script_run_ctx, None, ctx)) as executor:
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    download_osm_network, polygon_wkt, network_type, pbf_path, request_key, progress
+                ): network_type
+                for network_type in network_types
+            }
+
+            for future in poll_with_progress(futures, progress, on_progress):
+                network_type = futures[future]
+                try:
+                    success, result = future.result()
+                except Exception as e:
+                    logger.error(f"{network_type} download failed: {str(e)}")
+                    success, result = False, f"Error downloading {network_type} network: {str(e)}"
+
+                results[network_type] = (success, result)
+                if on_complete:
+                    on_complete(network_type, success, result, len(results), total)
+    except BaseException:
+        # A rerun or stop raised from a callback; nobody will release these graphs.
+        # The executor has waited for every download by now
+        for future in futures:
+            if not future.cancelled() and future.exception() is None:
+                success, result = future.result()
+                if success:
+                    release_shared_graph(result)
+        raise
+
+    if progress and progress.bytes_received:
+        progress.log_throughput(f"Network download {request_key or 'polygon'}")
+    return results
+
+# ---- Street geometry store ----
+# Everything drawn or exported runs from flat arrays: float32 lon/lat
+# coordinates with CSR-style offsets per edge and an int8 road class, about
+# 10 bytes per point against several hundred per edge in a graph. A store is
+# built once from the downloaded graphs, which can be released right after
+
+# Road classes, most major first; the index is the int8 class of an edge
+ROAD_CLASSES = (
+    ('motorway', 'trunk'),
+    ('primary',),
+    ('secondary',),
+    ('tertiary',),
+    ('residential', 'unclassified', 'living_street', 'road'),
+    ('service', 'track', 'busway'),
+    ('footway', 'cycleway', 'path', 'pedestrian', 'steps', 'bridleway', 'corridor'),
+)
+ROAD_CLASS_OTHER = len(ROAD_CLASSES)
+
+_ROAD_CLASS_BY_HIGHWAY = {highway: i for i, highways in enumerate(ROAD_CLASSES) for highway in highways}
+
+
+def road_class(highway):
+    """Return the road class of a highway tag value (or list of values); the most major wins"""
+    return min(
+        (_ROAD_CLASS_BY_HIGHWAY.get(h.removesuffix('_link'), ROAD_CLASS_OTHER) for h in _tag_values(highway)),
+        default=ROAD_CLASS_OTHER
+    )
+
+
+def is_reverse_twin(graph, u, v, k):
+    """
+    Check whether edge (u, v, k) is one direction of a two-way street
+
+    The reverse edge (v, u, k) must exist and trace the same line backwards;
+    two one-way streets between the same nodes (roundabout halves, one-way
+    pairs) are distinct edges.
+    """
+    import shapely
+
+    if u == v or not graph.has_edge(v, u, k):
+        return False
+    geometry = graph.edges[u, v, k].get('geometry')
+    other = graph.edges[v, u, k].get('geometry')
+    if geometry is None or other is None:
+        # Straight edges between the same nodes draw the same line
+        return geometry is None and other is None
+    return np.array_equal(shapely.get_coordinates(geometry), shapely.get_coordinates(other)[::-1])
+
+
+def graph_to_street_lines(graph):
+    """
+    Convert a street network graph into a compact street lines store
+
+    Each two-way street is stored once: of an edge and its reverse twin
+    (see is_reverse_twin), only the one running from the lower node ID is
+    kept and flagged in 'two_way'. Other reverse edges are kept on their own.
+
+    Args:
+        graph: NetworkX street network in WGS84
+
+    Returns:
+        dict: Same layout as parse_street_lines ('coords', 'offsets',
+            'road_class', 'masks') plus 'edge_ids' (E, 3) int64 u, v, key,
+            'two_way' bool, 'bounds' of the graph nodes, 'snapshot_time', 'missing_tiles'
+            and the graph's 'node_count' and 'edge_count'
+    """
+    import shapely
+
+    edges = []
+    twins = []
+    for u, v, k, data in graph.edges(keys=True, data=True):
+        twin = is_reverse_twin(graph, u, v, k)
+        if not (twin and u > v):
+            edges.append((u, v, k, data))
+            twins.append(twin)
+    two_way = np.array(twins, dtype=bool)
+    nodes = graph.nodes
+
+    # Straight edges have no geometry; draw them between their end nodes
+    geometries = np.array([data.get('geometry') for _, _, _, data in edges], dtype=object)
+    straight = np.fromiter((geometry is None for geometry in geometries), dtype=bool, count=len(edges))
+    if straight.any():
+        ends = np.array([
+            ((nodes[u]['x'], nodes[u]['y']), (nodes[v]['x'], nodes[v]['y']))
+            for (u, v, _, _), is_straight in zip(edges, straight) if is_straight
+        ])
+        geometries[straight] = shapely.linestrings(ends)
+
+    counts = shapely.get_num_coordinates(geometries) if len(edges) else np.zeros(0, dtype=np.int64)
+    offsets = np.zeros(len(edges) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    xs = np.fromiter((x for _, x in graph.nodes(data='x')), dtype=np.float64, count=len(nodes))
+    ys = np.fromiter((y for _, y in graph.nodes(data='y')), dtype=np.float64, count=len(nodes))
+
+    return {
+        'coords': shapely.get_coordinates(geometries).astype(np.float32) if len(edges) else np.zeros((0, 2), dtype=np.float32),
+        'offsets': offsets,
+        'road_class': np.fromiter((road_class(data.get('highway')) for _, _, _, data in edges), dtype=np.int8, count=len(edges)),
+        'masks': {
+            network_type: np.fromiter(
+                (edge_in_network(data, network_type) for _, _, _, data in edges), dtype=bool, count=len(edges)
+            )
+            for network_type in NETWORK_LABELS
+        },
+        'edge_ids': np.array([(u, v, k) for u, v, k, _ in edges], dtype=np.int64).reshape(-1, 3),
+        'two_way': two_way,
+        'bounds': tuple(float(b) for b in (xs.min(), ys.min(), xs.max(), ys.max())) if len(nodes) else (0.0, 0.0, 0.0, 0.0),
+        'snapshot_time': graph.graph.get('snapshot_time'),
+        'missing_tiles': graph.graph.get('missing_tiles', 0),
+        'node_count': len(nodes),
+        'edge_count': len(graph.edges),
+    }
+
+
+def _gather_points(starts, ends):
+    """
+    Lay out a selection of edges back to back
+
+    Args:
+        starts: Index of the first point of each selected edge
+        ends: Index past the last point of each selected edge
+
+    Returns:
+        tuple: (int64 offsets of the selected edges, indices of their points)
+    """
+    offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+    np.cumsum(ends - starts, out=offsets[1:])
+    points = np.repeat(starts - offsets[:-1], ends - starts) + np.arange(offsets[-1])
+    return offsets, points
+
+
+def _column_map(table, name, encoded, func):
+    """
+    Apply func to each distinct value of a table column, one result per row
+
+    Args:
+        table: pyarrow.Table from the graph store
+        name: Column name; a missing column holds None in every row
+        encoded: JSON-encoded column names of the table
+        func: Function of one (decoded) value
+
+    Returns:
+        numpy.ndarray: func of each row's value
+    """
+    import pandas as pd
+
+    if name not in table.column_names:
+        return np.full(table.num_rows, func(None))
+    codes, uniques = pd.factorize(table.column(name).to_pandas())
+    if name in encoded:
+        uniques = [json.loads(value) for value in uniques]
+    # Nulls get code -1, the func(None) appended last
+    return np.array([func(value) for value in uniques] + [func(None)])[codes]
+
+
+def graph_store_street_lines(key):
+    """
+    Build the street lines of a stored full network straight from its tables
+
+    Gives the same edges, masks and twins as graph_to_street_lines on the
+    loaded graph, with no graph or per-edge attribute dicts rebuilt: the
+    filters run once per distinct tag value and twins are matched on
+    packed edge IDs.
+
+    Args:
+        key: Graph store key of the full network
+
+    Returns:
+        dict or None: Street lines of every edge, with a mask per network
+        type, or None if the network is not stored
+    """
+    import pandas as pd
+    import shapely
+
+    stored = graph_store_read(key)
+    if stored is None:
+        return None
+    entry, nodes_table, edges_table = stored
+    encoded = entry['edges_encoded']
+
+    us, vs, keys = (edges_table.column(name).to_numpy() for name in ('u', 'v', 'key'))
+    node_ids = nodes_table.column('osmid').to_numpy()
+    xs = nodes_table.column('x').to_numpy()
+    ys = nodes_table.column('y').to_numpy()
+
+    # Straight edges have no geometry; draw them between their end nodes
+    if 'geometry' in edges_table.column_names:
+        geometries = shapely.from_wkb(edges_table.column('geometry').to_numpy(zero_copy_only=False))
+    else:
+        geometries = np.full(len(us), None, dtype=object)
+    straight = shapely.is_missing(geometries)
+    counts = np.where(straight, 2, shapely.get_num_coordinates(geometries))
+    offsets = np.zeros(len(us) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    coords = np.empty((offsets[-1], 2))
+    coords[~np.repeat(straight, counts)] = shapely.get_coordinates(geometries[~straight])
+    if straight.any():
+        order = np.argsort(node_ids)
+        ends = order[np.searchsorted(node_ids, np.stack([us[straight], vs[straight]], axis=1), sorter=order)]
+        first = offsets[:-1][straight]
+        coords[first] = np.stack([xs[ends[:, 0]], ys[ends[:, 0]]], axis=1)
+        coords[first + 1] = np.stack([xs[ends[:, 1]], ys[ends[:, 1]]], axis=1)
+
+    # Reverse edge of each edge, through packed (u, v, key) over dense node indices
+    codes, uniques = pd.factorize(np.concatenate([us, vs]))
+    cu, cv = codes[:len(us)], codes[len(us):]
+    key_count = int(keys.max()) + 1 if len(keys) else 1
+    forward = (cu * len(uniques) + cv) * key_count + keys
+    reverse = (cv * len(uniques) + cu) * key_count + keys
+    order = np.argsort(forward)
+    position = np.minimum(np.searchsorted(forward, reverse, sorter=order), max(len(us) - 1, 0))
+    partner = order[position] if len(us) else position
+    found = (forward[partner] == reverse) & (us != vs) if len(us) else np.zeros(0, dtype=bool)
+
+    # Twins trace the same line backwards (see is_reverse_twin)
+    twin = found & straight & straight[partner]
+    candidates = np.flatnonzero(found & ~straight & ~straight[partner] & (counts == counts[partner]))
+    if len(candidates):
+        n = counts[candidates]
+        firsts = np.cumsum(n) - n
+        within = np.arange(n.sum()) - np.repeat(firsts, n)
+        here = np.repeat(offsets[candidates], n) + within
+        there = np.repeat(offsets[partner[candidates]] + n - 1, n) - within
+        same = (coords[here] == coords[there]).all(axis=1)
+        twin[candidates] = np.logical_and.reduceat(same, firsts)
+
+    keep = np.flatnonzero(~(twin & (us > vs)))
+    offsets_kept, points = _gather_points(offsets[:-1][keep], offsets[1:][keep])
+
+    masks = {}
+    for network_type in NETWORK_LABELS:
+        mask = np.ones(len(us), dtype=bool)
+        for tag in ['highway', *NETWORK_EXCLUDED_TAGS[network_type]]:
+            mask &= _column_map(edges_table, tag, encoded, partial(_tag_in_network, tag, network_type=network_type))
+        masks[network_type] = mask[keep]
+
+    return {
+        'coords': coords[points].astype(np.float32),
+        'offsets': offsets_kept,
+        'road_class': _column_map(edges_table, 'highway', encoded, road_class).astype(np.int8)[keep],
+        'masks': masks,
+        'edge_ids': np.stack([us, vs, keys], axis=1).astype(np.int64)[keep],
+        'two_way': twin[keep],
+        'bounds': tuple(float(b) for b in (xs.min(), ys.min(), xs.max(), ys.max())) if len(xs) else (0.0, 0.0, 0.0, 0.0),
+        'snapshot_time': entry['graph'].get('snapshot_time', entry['created']),
+        'missing_tiles': entry['graph'].get('missing_tiles', 0),
+        'node_count': nodes_table.num_rows,
+        'edge_count': len(us),
+    }
+
+
+def subset_street_lines(lines, network_types):
+    """
+    Keep the edges of a street lines store in any of some network types
+
+    Args:
+        lines: Street lines dict with 'edge_ids' and 'two_way'
+        network_types: List of network types ('drive', 'bike', 'walk')
+
+    Returns:
+        dict: Street lines of the selected edges, counting nodes and edges
+        as the derived network graphs would
+    """
+    selected = np.zeros(len(lines['offsets']) - 1, dtype=bool)
+    for network_type in network_types:
+        selected |= lines['masks'][network_type]
+    keep = np.flatnonzero(selected)
+
+    offsets, points = _gather_points(lines['offsets'][:-1][keep], lines['offsets'][1:][keep])
+    coords = lines['coords'][points]
+    edge_ids = lines['edge_ids'][keep]
+    two_way = lines['two_way'][keep]
+    ends = np.concatenate([coords[offsets[:-1]], coords[offsets[1:] - 1]]) if len(keep) else np.zeros((1, 2))
+
+    return {
+        'coords': coords,
+        'offsets': offsets,
+        'road_class': lines['road_class'][keep],
+        'masks': {network_type: mask[keep] for network_type, mask in lines['masks'].items()},
+        'edge_ids': edge_ids,
+        'two_way': two_way,
+        'bounds': (*ends.min(axis=0).tolist(), *ends.max(axis=0).tolist()),
+        'snapshot_time': lines['snapshot_time'],
+        'missing_tiles': lines['missing_tiles'],
+        'node_count': len(np.unique(edge_ids[:, :2])),
+        'edge_count': len(keep) + int(two_way.sum()),
+    }
+
+
+def union_street_lines(parts):
+    """
+    Union street line stores of the same full network by edge ID
+
+    Edges are matched by direction on (u, v, key); a two-way entry stands
+    for both of its directions. An entry is dropped when any direction it
+    stands for was already covered by an earlier one, which is then the
+    same street of the full network. Reverse edges that are not twins
+    (contraflow cycleways, one-way pairs) have their own IDs and are kept.
+    Hash-based deduplication and one gather of the coordinates keep this
+    linear in the number of points, with no per-edge Python objects.
+
+    Args:
+        parts: Non-empty list of street lines dicts from graph_to_street_lines
+
+    Returns:
+        dict: Street lines of every edge in any of the parts
+    """
+    import pandas as pd
+
+    if len(parts) == 1:
+        return dict(parts[0])
+
+    edge_ids = np.concatenate([part['edge_ids'] for part in parts])
+    two_way_all = np.concatenate([part['two_way'] for part in parts])
+    entries = np.arange(len(edge_ids))
+    twins = np.flatnonzero(two_way_all)
+
+    # Pack each directed edge into one int64 over dense node indices, then hash it
+    node_codes, node_ids = pd.factorize(edge_ids[:, :2].ravel())
+    node_codes = node_codes.reshape(-1, 2)
+    key_count = int(edge_ids[:, 2].max()) + 1
+    forward = (node_codes[:, 0] * len(node_ids) + node_codes[:, 1]) * key_count + edge_ids[:, 2]
+    reverse = (node_codes[twins, 1] * len(node_ids) + node_codes[twins, 0]) * key_count + edge_ids[twins, 2]
+    codes, uniques = pd.factorize(np.concatenate([forward, reverse]))
+    forward_codes, reverse_codes = codes[:len(entries)], codes[len(entries):]
+
+    # Each directed edge belongs to the first entry standing for it
+    first_entry = np.full(len(uniques), len(entries))
+    np.minimum.at(first_entry, codes, np.concatenate([entries, twins]))
+    kept = first_entry[forward_codes] == entries
+    kept[twins] &= first_entry[reverse_codes] == twins
+    keep = np.flatnonzero(kept)
+
+    # A kept one-way entry is two-way when a twin elsewhere covers it
+    twin_covered = np.zeros(len(uniques), dtype=bool)
+    twin_covered[forward_codes[twins]] = True
+    twin_covered[reverse_codes] = True
+    two_way = two_way_all[keep] | twin_covered[forward_codes[keep]]
+
+    # Gather the points of the kept edges through the concatenated offsets
+    point_base = np.cumsum([0] + [len(part['coords']) for part in parts[:-1]])
+    starts = np.concatenate([part['offsets'][:-1] + base for part, base in zip(parts, point_base)])[keep]
+    ends = np.concatenate([part['offsets'][1:] + base for part, base in zip(parts, point_base)])[keep]
+    offsets, points = _gather_points(starts, ends)
+
+    bounds = np.array([part['bounds'] for part in parts])
+    return {
+        'coords': np.concatenate([part['coords'] for part in parts])[points],
+        'offsets': offsets,
+        'road_class': np.concatenate([part['road_class'] for part in parts])[keep],
+        'masks': {
+            network_type: np.concatenate([part['masks'][network_type] for part in parts])[keep]
+            for network_type in NETWORK_LABELS
+        },
+        'edge_ids': edge_ids[keep],
+        'two_way': two_way,
+        'bounds': (*bounds[:, :2].min(axis=0).tolist(), *bounds[:, 2:].max(axis=0).tolist()),
+        'snapshot_time': min((part['snapshot_time'] for part in parts if part['snapshot_time'] is not None), default=None),
+        'missing_tiles': max(part['missing_tiles'] for part in parts),
+        'node_count': len(node_ids),
+        'edge_count': len(uniques),
+    }
+
+
+def street_lines_key(store_key, network_types):
+    """Shared cache key of the street lines of some network types of a full network"""
+    return store_key, f"lines:{'+'.join(network_types)}"
+
+
+def _street_lines_arrays(lines):
+    """Return every numpy array of a street lines store"""
+    arrays = [lines['coords'], lines['offsets'], *lines['masks'].values()]
+    return arrays + [lines[name] for name in ('road_class', 'edge_ids', 'two_way') if name in lines]
+
+
+def street_lines_bytes(lines):
+    """Return the memory held by the arrays of a street lines store"""
+    return sum(a.nbytes for a in _street_lines_arrays(lines))
+
+
+def freeze_street_lines(lines):
+    """Make the arrays of a street lines store read-only so it can be shared"""
+    for a in _street_lines_arrays(lines):
+        a.flags.writeable = False
+    return lines
+
+
+def shared_street_lines(store_key, network_types, graphs):
+    """
+    Get the shared street lines of some networks, building them on a miss
+
+    Each network type is converted from its graph once and kept on its
+    own, so any combination of types is a union of cached stores.
+
+    Args:
+        store_key: Graph store key of the full network
+        network_types: Network types the graphs were derived as
+        graphs: The downloaded network graphs, in network_types order
+
+    Returns:
+        dict: Frozen street lines; release with release_shared_graph
+    """
+    start = time.monotonic()
+    key = street_lines_key(store_key, network_types)
+    lines = shared_graph_acquire(key)
+    if lines is not None:
+        record_cache_hit("network", time.monotonic() - start)
+        return lines
+
+    parts = []
+    for network_type, graph in zip(network_types, graphs):
+        part_key = street_lines_key(store_key, [network_type])
+        part = shared_graph_acquire(part_key)
+        if part is None:
+            part = shared_graph_put(part_key, graph_to_street_lines(graph))
+        parts.append(part)
+
+    if len(parts) == 1:
+        lines = parts[0]
+    else:
+        try:
+            lines = shared_graph_put(key, union_street_lines(parts))
+        finally:
+            for part in parts:
+                release_shared_graph(part)
+
+    logger.info(f"Built street lines: {len(lines['offsets']) - 1:,} edges | {len(lines['coords']):,} points | "
+                f"{street_lines_bytes(lines) / 1e6:.1f} MB")
+    record_cache_miss("network", time.monotonic() - start)
+    return lines
+
+
+def stored_street_lines(store_key, network_types):
+    """
+    Get the street lines of some networks from the stored full network
+
+    The full network's lines are read from the graph store's tables once
+    and kept shared; each combination of types is a subset of them.
+
+    Args:
+        store_key: Graph store key of the full network
+        network_types: Network types to draw
+
+    Returns:
+        dict or None: Frozen street lines, release with release_shared_graph;
+        None if the full network is not stored
+    """
+    start = time.monotonic()
+    full_key = street_lines_key(store_key, ['all'])
+    full = shared_graph_acquire(full_key)
+    if full is None:
+        lines = graph_store_street_lines(store_key)
+        if lines is None:
+            return None
+        full = shared_graph_put(full_key, lines)
+
+    try:
+        lines = shared_graph_put(street_lines_key(store_key, network_types), subset_street_lines(full, network_types))
+    finally:
+        release_shared_graph(full)
+
+    logger.info(f"Read street lines from the graph store in {time.monotonic() - start:.2f}s: "
+                f"{len(lines['offsets']) - 1:,} edges | {len(lines['coords']):,} points")
+    record_cache_hit("graph_store", time.monotonic() - start)
+    return lines
+
+
+# ---- Poster mode ----
+# Street geometry for drawing only: ways come straight from Overpass with
+# inline coordinates ("out geom") into flat arrays, with no graph building,
+# simplification or component analysis
+
+def parse_street_lines(elements):
+    """
+    Parse a stream of Overpass "out geom" elements into flat coordinate arrays
+
+    Args:
+        elements: Iterable of Overpass way elements
+
+    Returns:
+        dict: 'coords' float32 (N, 2) lon/lat array, 'offsets' int64 array
+            where way i spans coords[offsets[i]:offsets[i + 1]], an int8
+            'road_class' per way and 'masks' mapping each network type to
+            a per-way bool array
+    """
+    coords = array('f')
+    offsets = array('q', [0])
+    way_ids = []
+    drawn = set()
+    way_tags = {}
+
+    for element in elements:
+        if element.get('type') != 'way':
+            continue
+
+        # convert emits an empty string for tags the way does not have
+        tags = {k: v for k, v in element.get('tags', {}).items() if v != ''}
+        if tags:
+            way_tags.setdefault(element['id'], {}).update(tags)
+
+        geometry = [point for point in element.get('geometry', []) if point]
+        if len(geometry) < 2 or element['id'] in drawn:
+            continue
+        drawn.add(element['id'])
+        way_ids.append(element['id'])
+
+        for point in geometry:
+            coords.append(point['lon'])
+            coords.append(point['lat'])
+        offsets.append(len(coords) // 2)
+
+    masks = {
+        network_type: np.fromiter(
+            (edge_in_network(way_tags.get(way_id, {}), network_type) for way_id in way_ids),
+            dtype=bool, count=len(way_ids)
+        )
+        for network_type in NETWORK_LABELS
+    }
+
+    return {
+        'coords': np.frombuffer(coords, dtype=np.float32).reshape(-1, 2),
+        'offsets': np.frombuffer(offsets, dtype=np.int64),
+        'road_class': np.fromiter(
+            (road_class(way_tags.get(way_id, {}).get('highway')) for way_id in way_ids),
+            dtype=np.int8, count=len(way_ids)
+        ),
+        'masks': masks,
+    }
+
+
+# Download street geometry for poster mode with caching
+@metered_cache("street_lines")
+@st.cache_data(ttl=3600, show_spinner=False)
+def download_street_lines(polygon_wkt, request_key=None, major_roads_only=False, _progress=None):
+    """
+    Download street way geometry for given polygon, without building a graph
+
+    Args:
+        polygon_wkt: Well-Known Text representation of polygon
+        request_key: Canonical request key (part of the cache key only)
+        major_roads_only: Only download motorways down to tertiary roads
+        _progress: Optional DownloadProgress (not part of the cache key)
+
+    Returns:
+        tuple: (success, lines_dict_or_error_message)
+    """
+    _mark_cache_miss()
+    try:
+        from shapely import wkt
+        polygon = wkt.loads(polygon_wkt)
+        configure_osmnx()
+
+        queries = build_network_queries(polygon, geometry=True, major_roads_only=major_roads_only)
+        lines, snapshot_time = fetch_with_snapshot_time(
+            parse_street_lines,
+            (element for query in queries for element in iter_overpass_elements(query, _progress))
+        )
+        lines['bounds'] = polygon.bounds
+        lines['snapshot_time'] = snapshot_time
+        if _progress:
+            _progress.log_throughput(f"Street line download {request_key or 'polygon'}")
+
+        logger.info(f"Downloaded street lines: {len(lines['offsets']) - 1:,} ways | {len(lines['coords']):,} points")
+        return True, lines
+
+    except Exception as e:
+        logger.error(f"Street line download error: {str(e)}")
+        return False, f"Error downloading streets: {str(e)}"
+
+
+def select_street_lines(lines, network_types):
+    """
+    Keep only the ways that belong to any of the given network types
+
+    Args:
+        lines: Street lines dict from download_street_lines or
+            graph_to_street_lines
+        network_types: List of network types ('drive', 'bike', 'walk')
+
+    Returns:
+        list: One (n, 2) coordinate array view per selected way
+    """
+    keep = np.zeros(len(lines['offsets']) - 1, dtype=bool)
+    for network_type in network_types:
+        keep |= lines['masks'][network_type]
+
+    segments = np.split(lines['coords'], lines['offsets'][1:-1])
+    return [segment for segment, kept in zip(segments, keep) if kept]
+
+
+# Add city, network and credit labels to a map
+def add_map_labels(ax, city_name, network_types, font_prop=None):
+    """
+    Draw the city name, network types and credit onto map axes
+
+    Args:
+        ax: Matplotlib axes of the map
+        city_name: Name of the city for labeling
+        network_types: String describing network types
+        font_prop: Font properties for text
+    """
+    formatted_city_name = city_name.title()
+
+    # Base style
+    base_kwargs = {
+        'color': 'white',
+        'ha': 'left',
+        'va': 'bottom',
+        'transform': ax.transAxes}
+    
+    if font_prop:
+        base_kwargs['fontproperties'] = font_prop
+
+    city_kwargs = dict(base_kwargs)
+    city_kwargs.update({'fontsize': 20, 'weight': 'bold'})
+    network_kwargs = dict(base_kwargs)
+    network_kwargs.update({'fontsize': 15})
+
+    # Place at bottom inside axes; minimal gap
+    x_position = 0.05
+    city_y = 0.03
+    gap = 0.025 
+    network_y = city_y + gap
+
+    ax.text(x_position, network_y, network_types, **network_kwargs)
+    ax.text(x_position, city_y, formatted_city_name, **city_kwargs)
+
+    # Add credit at BOTTOM RIGHT
+    credit_kwargs = {
+        'color': 'white',
+        'ha': 'right',              
+        'va': 'bottom',
+        'fontsize': 9,             
+        'alpha': 0.7,               
+        'transform': ax.transAxes
+    }
+    if font_prop:
+        credit_kwargs['fontproperties'] = font_prop
+        
+    ax.text(0.95, 0.03, 'App by Pradip Shrestha, 2026', **credit_kwargs)
+
+# Look of every rendered map; part of the render cache key
+MAP_STYLE = {
+    'figsize': (20, 20),
+    'edge_color': 'white',
+    'edge_linewidth': 0.5,
+    'bgcolor': 'black',
+}
+
+# Generate map visualization from street lines
+def generate_lines_image(segments, bounds, city_name, network_types, font_prop=None):
+    """
+    Generate map visualization from street line coordinates
+
+    Args:
+        segments: List of (n, 2) lon/lat arrays, one per street way
+        bounds: (minx, miny, maxx, maxy) of the map area
+        city_name: Name of the city for labeling
+        network_types: String describing network types
+        font_prop: Font properties for text
+
+    Returns:
+        tuple: (success, figure_or_error_message)
+    """
+    try:
+        from matplotlib.collections import LineCollection
 
-        if not os.path.exists(font_path):
-            urllib.request.urlretrieve(font_url, font_path)
-            logger.info("Font downloaded successfully")
+        fig, ax = plt.subplots(figsize=MAP_STYLE['figsize'], facecolor=MAP_STYLE['bgcolor'], frameon=False)
+        ax.set_facecolor(MAP_STYLE['bgcolor'])
+        ax.add_collection(LineCollection(
+            segments, colors=MAP_STYLE['edge_color'], linewidths=MAP_STYLE['edge_linewidth'], zorder=1
+        ))
+        ox.plot._config_ax(ax, 'epsg:4326', bounds, 0.02)
+
+        add_map_labels(ax, city_name, network_types, font_prop)
+
+        fig.subplots_adjust(top=0.98, bottom=0.02)
+
+        logger.info("Map visualization created successfully")
+        return True, fig
 
-        font_prop = fm.FontProperties(fname=font_path)
-        return font_prop
     except Exception as e:
-        logger.warning(f"Could not load custom font: {e}")
-        return None
+        logger.error(f"Map generation error: {str(e)}")
+        return False, f"Error generating map: {str(e)}"
 
-# Geocode city with caching
-@st.cache_data(ttl=86400)  
-def geocode_city(city_name):
+# Longest side of the on-screen preview, in pixels
+PREVIEW_MAX_PIXELS = int(os.environ.get("PREVIEW_MAX_PIXELS", 1600))
+
+# Padding kept around the drawn content, as savefig's pad_inches
+RENDER_PAD_INCHES = 0.1
+
+
+# Rasterize a figure for download and preview
+def render_figure(fig, dpi=150):
     """
-    Geocode a city name to coordinates with error handling
-    
+    Rasterize a figure once, then encode the PNG export and the preview
+
+    The canvas is drawn a single time at the export DPI and cropped to the
+    drawn content like bbox_inches='tight'; the preview is a downscaled
+    copy of the same pixels.
+
     Args:
-        city_name: Name of the city
-        timeout: Request timeout in seconds
-    
+        fig: Matplotlib figure
+        dpi: Export resolution
+
     Returns:
-        tuple: (success, location_or_error_message)
+        tuple: (png_bytes, preview_png_bytes)
     """
-    try:
-        # Use OSMnx's Built-in Geocoder
-        gdf = ox.geocode_to_gdf(city_name)
-        if gdf.empty:
-            return False, f"City '{city_name}' not found."
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from PIL import Image
 
-        geom = gdf.iloc[0].geometry
-        lat = geom.centroid.y
-        lon = geom.centroid.x
+    fig.set_dpi(dpi)
+    canvas = FigureCanvasAgg(fig)
+    canvas.draw()
 
-        return True, {
-            "latitude": lat,
-            "longitude": lon,
-            "address": city_name
-        }
+    # Extent of the drawn artists; layout only, nothing is rasterized again
+    bbox = fig.get_tightbbox(canvas.get_renderer()).padded(RENDER_PAD_INCHES)
+    width, height = canvas.get_width_height()
+    left, top = round(bbox.x0 * dpi), round(height - bbox.y1 * dpi)
+    crop = (
+        max(0, left),
+        max(0, top),
+        min(width, left + round(bbox.width * dpi)),
+        min(height, top + round(bbox.height * dpi)),
+    )
+    image = Image.frombuffer('RGBA', (width, height), canvas.buffer_rgba(), 'raw', 'RGBA', 0, 1)
+    image = image.crop(crop).convert('RGB')
 
-    except Exception as e:
-        return False, f"Geocoding error: {str(e)}"
+    png = io.BytesIO()
+    image.save(png, format='PNG', dpi=(dpi, dpi))
 
-# Create buffer around city with caching
-@st.cache_data(ttl=3600)  
-def create_city_buffer(latitude, longitude, buffer_meters, crs_code):
+    image.thumbnail((PREVIEW_MAX_PIXELS, PREVIEW_MAX_PIXELS), Image.Resampling.LANCZOS, reducing_gap=2.0)
+    # Previews are only shown once, so speed wins over size
+    preview = io.BytesIO()
+    image.save(preview, format='PNG', compress_level=1)
+
+    return png.getvalue(), preview.getvalue()
+
+# ---- Rendered image cache ----
+# PNG exports and their previews are kept on disk under a hash of everything
+# that shapes the image, so a repeat export skips rasterization and PNG
+# encoding entirely
+RENDER_CACHE_DIR = Path(os.environ.get("RENDER_CACHE_DIR", "render_cache"))
+RENDER_CACHE_MAX_BYTES = int(os.environ.get("RENDER_CACHE_MAX_BYTES", 512 * 1024 ** 2))
+
+# Bump when the drawing code changes in a way MAP_STYLE does not capture
+RENDER_CACHE_VERSION = 2
+
+_render_cache_lock = threading.Lock()
+
+
+def render_cache_key(source_key, snapshot_time, city_name, network_label, dpi, font_prop=None):
     """
-    Create a buffered area around city coordinates
+    Build the content address of a rendered map
 
     Args:
-        latitude: City latitude
-        longitude: City longitude
-        buffer_meters: Buffer radius in meters
-        crs_code: Coordinate reference system EPSG code
+        source_key: Key of the drawn data (graph store key or poster request)
+        snapshot_time: When the drawn data was downloaded
+        city_name: City label text
+        network_label: Network types label text
+        dpi: Export resolution
+        font_prop: Font properties used for the labels, if any
 
     Returns:
-        tuple: (success, geodataframe_or_error_message)
+        str: Hex digest usable as a file name
     """
+    payload = json.dumps([
+        RENDER_CACHE_VERSION, source_key, snapshot_time, city_name, network_label,
+        MAP_STYLE, dpi, font_prop.get_file() if font_prop else None
+    ], default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def _load_render_cache_index():
+    """Read the render cache index (key -> entry metadata)"""
+    index_path = RENDER_CACHE_DIR / "index.json"
+    if not index_path.exists():
+        return {}
     try:
-        # Create GeoDataFrame from coordinates
-        cities_df = gpd.GeoDataFrame(
-            {'geometry': [gpd.points_from_xy([longitude], [latitude])[0]]},
-            crs='EPSG:4326'
-        )
+        return json.loads(index_path.read_text())
+    except (OSError, ValueError) as e:
+        logger.warning(f"Render cache index unreadable, starting fresh: {e}")
+        return {}
 
-        # Transform to specified CRS for accurate buffering
-        cities_df = cities_df.to_crs(epsg=crs_code)
-        cities_df['buffer'] = cities_df.geometry.buffer(buffer_meters)
-        cities_df = cities_df.set_geometry('buffer')
 
-        # Transform back to WGS84 for OSM queries
-        cities_df = cities_df.to_crs(epsg=4326)
+def _save_render_cache_index(index):
+    """Atomically write the render cache index"""
+    RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    tmp_path = RENDER_CACHE_DIR / "index.json.tmp"
+    tmp_path.write_text(json.dumps(index))
+    os.replace(tmp_path, RENDER_CACHE_DIR / "index.json")
 
-        logger.info(f"Buffer created: {buffer_meters}m radius")
-        return True, cities_df
 
-    except Exception as e:
-        logger.error(f"Buffer creation error: {str(e)}")
-        return False, f"Error creating buffer: {str(e)}"
+def render_cache_get(key, etag=None):
+    """
+    Look up a rendered map, revalidating a copy the caller already holds
+
+    Like an HTTP conditional request: when etag matches the cached image,
+    the PNGs are not read and (etag, None, None) means "not modified".
+
+    Args:
+        key: Key from render_cache_key
+        etag: ETag of the copy the caller holds, if any
+
+    Returns:
+        tuple: (etag, png_bytes, preview_bytes), (etag, None, None) if not
+        modified, or (None, None, None) on a miss
+    """
+    with _render_cache_lock:
+        index = _load_render_cache_index()
+        entry = index.get(key)
+        if entry is None:
+            return None, None, None
+
+        entry['last_access'] = time.time()
+        _save_render_cache_index(index)
+        if etag == entry['etag']:
+            return etag, None, None
+
+        try:
+            png = (RENDER_CACHE_DIR / f"{key}.png").read_bytes()
+            preview = (RENDER_CACHE_DIR / f"{key}.preview.png").read_bytes()
+        except OSError as e:
+            logger.warning(f"Render cache entry {key} unreadable: {e}")
+            index.pop(key, None)
+            _save_render_cache_index(index)
+            return None, None, None
+
+    return entry['etag'], png, preview
+
 
-# Download OSM network data with caching
-@st.cache_data(ttl=3600, show_spinner=False)  
-def download_osm_network(polygon_wkt, network_type):
+def render_cache_put(key, png, preview):
     """
-    Download OSM network data for given polygon
+    Store a rendered map, evicting least recently used images over the byte cap
 
     Args:
-        polygon_wkt: Well-Known Text representation of polygon
-        network_type: Type of network ('drive', 'bike', 'walk', 'all')
+        key: Key from render_cache_key
+        png: PNG bytes
+        preview: Preview PNG bytes
 
     Returns:
-        tuple: (success, graph_or_error_message)
+        str: ETag of the stored image
+    """
+    etag = hashlib.sha256(png).hexdigest()[:32]
+    size = len(png) + len(preview)
+    with _render_cache_lock:
+        RENDER_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for name, data in ((f"{key}.preview.png", preview), (f"{key}.png", png)):
+            tmp_path = RENDER_CACHE_DIR / f"{name}.tmp"
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, RENDER_CACHE_DIR / name)
+
+        index = _load_render_cache_index()
+        now = time.time()
+        index[key] = {'etag': etag, 'bytes': size, 'created': now, 'last_access': now}
+        record_cache_store("render", size)
+
+        total = sum(entry['bytes'] for entry in index.values())
+        for evict_key in sorted(index, key=lambda k: index[k]['last_access']):
+            if total <= RENDER_CACHE_MAX_BYTES:
+                break
+            evicted_bytes = index.pop(evict_key)['bytes']
+            total -= evicted_bytes
+            record_cache_eviction("render", evicted_bytes)
+            (RENDER_CACHE_DIR / f"{evict_key}.png").unlink(missing_ok=True)
+            (RENDER_CACHE_DIR / f"{evict_key}.preview.png").unlink(missing_ok=True)
+            logger.info(f"Evicted rendered map {evict_key}")
+        _save_render_cache_index(index)
+
+    logger.info(f"Cached rendered map {key} ({size / 1e6:.1f} MB)")
+    return etag
+
+
+def cached_render(key):
+    """
+    Get a rendered map for this session, revalidating the one it last exported
+
+    Returns:
+        tuple: (png_bytes, preview_bytes), or (None, None) if the map must
+        be rendered
     """
+    start = time.monotonic()
+    held = st.session_state.get('last_render')
+    held_etag = held['etag'] if held and held['key'] == key else None
+    etag, png, preview = render_cache_get(key, held_etag)
+    if etag is None:
+        return None, None
+    if png is None:
+        logger.info(f"Rendered map {key} not modified; reusing the session copy")
+        png, preview = held['png'], held['preview']
+    st.session_state['last_render'] = {'key': key, 'etag': etag, 'png': png, 'preview': preview}
+    record_cache_hit("render", time.monotonic() - start)
+    return png, preview
+
+
+def remember_render(key, png, preview, seconds=0.0):
+    """Cache a fresh render, taking seconds to make, and keep it as this session's latest export"""
+    record_cache_miss("render", seconds)
     try:
-        from shapely import wkt
-        polygon = wkt.loads(polygon_wkt)
+        etag = render_cache_put(key, png, preview)
+    except OSError as e:
+        logger.warning(f"Could not cache rendered map: {e}")
+        return
+    st.session_state['last_render'] = {'key': key, 'etag': etag, 'png': png, 'preview': preview}
+
+
+# ---- Memory admission ----
+# Requests are sized before anything is downloaded: the street node count
+# comes from an Overpass count query (or the density model when that fails
+# or a local extract is used) and becomes a peak memory estimate. Requests
+# that do not fit in what is left of the budget are downgraded step by step
+# (lower DPI, poster mode, major roads only) or rejected
+
+
+def _default_memory_budget():
+    """Half the physical memory, or 4 GB where it cannot be read"""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        return 4 * 1024 ** 3
+
+
+# Memory all running map requests may reserve together
+MEMORY_BUDGET_BYTES = int(os.environ.get("MEMORY_BUDGET_BYTES", 0)) or _default_memory_budget()
+
+# Ask Overpass for the street node count; the density model is used otherwise
+PREFLIGHT_COUNT_QUERY = os.environ.get("PREFLIGHT_COUNT_QUERY", "1") == "1"
+
+# The count query gets one short attempt; a slow Overpass must not hold up
+# a request that the density model can size well enough
+PREFLIGHT_TIMEOUT = int(os.environ.get("PREFLIGHT_TIMEOUT", 10))
+
+# Peak bytes per OSM street node: building, simplifying and extracting
+# graphs, or streaming poster lines into arrays and drawing them
+PREFLIGHT_GRAPH_NODE_BYTES = 3000
+PREFLIGHT_LINES_NODE_BYTES = 150
+
+# Share of street nodes on motorways down to tertiary roads
+PREFLIGHT_MAJOR_ROAD_SHARE = 0.15
+
+# RGBA canvas, its PNG encoding and the preview are alive at the same time
+PREFLIGHT_RASTER_COPIES = 3
+
+# DPI that over-budget requests are lowered to
+PREFLIGHT_MIN_DPI = 150
+
+_memory_reserved = 0
+_memory_lock = threading.Lock()
+
+
+def build_count_queries(polygon):
+    """Build Overpass queries counting the street ways and nodes of a polygon"""
+    way_filter = ox._overpass._get_network_filter("all")
+    overpass_settings = f"[out:json][timeout:{PREFLIGHT_TIMEOUT}]"
+    return [
+        f"{overpass_settings};way{way_filter}(poly:{coords!r})->.ways;.ways out count;node(w.ways);out count;"
+        for coords in ox._overpass._make_overpass_polygon_coord_strs(polygon)
+    ]
 
-        # ---- OSMnx Performance Settings ----
-        ox.settings.use_cache = True              
-        ox.settings.log_console = False           
-        ox.settings.timeout = 180                 
-        ox.settings.memory = 1024                 
-        ox.settings.max_query_area_size = 50_000_000  
 
-        # Optional: speed boost for large polygons
-        if polygon.area > 5:  
-            simplify = True
+def cached_street_nodes(store_key, network_types=None):
+    """
+    Node count of a network already in the shared cache or graph store
+
+    Nothing is loaded and no reference is taken; only the entries' metadata
+    is read.
+
+    Args:
+        store_key: Key from network_store_key
+        network_types: Network types whose street lines may be cached
+
+    Returns:
+        int or None: Node count, or None if the network is not cached
+    """
+    keys = [(store_key, None)]
+    if network_types:
+        keys.insert(0, street_lines_key(store_key, network_types))
+    with _shared_graphs_lock:
+        for key in keys:
+            entry = _shared_graphs.get(key)
+            if entry is None:
+                continue
+            value = entry['graph']
+            snapshot_time = _shared_snapshot_time(value)
+            if snapshot_time is not None and time.time() - snapshot_time > GRAPH_STORE_MAX_AGE:
+                continue
+            return value['node_count'] if isinstance(value, dict) else len(value.nodes)
+
+    with _graph_store_lock:
+        entry = _load_graph_store_index().get(store_key)
+    if entry is None or time.time() - entry['created'] > GRAPH_STORE_MAX_AGE:
+        return None
+    return entry.get('node_count')
+
+
+def estimate_street_nodes(polygon, pbf_path=None, store_key=None, network_types=None):
+    """
+    Estimate how many OSM street nodes a polygon holds
+
+    A network that is already cached is sized from its stored node count,
+    so Overpass is only asked about areas that will be downloaded anyway.
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        pbf_path: Local .osm.pbf extract the request reads, if any
+        store_key: Key from network_store_key to look up cached networks
+        network_types: Network types whose street lines may be cached
+
+    Returns:
+        tuple: (node count, 'cache', 'count query' or 'density model')
+    """
+    if store_key:
+        nodes = cached_street_nodes(store_key, network_types)
+        if nodes is not None:
+            return nodes, 'cache'
+
+    if PREFLIGHT_COUNT_QUERY and not pbf_path:
+        try:
+            configure_osmnx()
+            nodes = 0
+            for query in build_count_queries(polygon):
+                for element in iter_overpass_elements(query, timeout=PREFLIGHT_TIMEOUT, attempts=1):
+                    if element.get('type') == 'count':
+                        nodes += int(element.get('tags', {}).get('nodes', 0))
+            return nodes, 'count query'
+        except Exception as e:
+            logger.warning(f"Pre-flight count query failed ({e}); using the density model")
+
+    return int(polygon_area_km2(polygon) * ESTIMATED_EDGES_PER_KM2), 'density model'
+
+
+def estimate_request_bytes(nodes, dpi, poster_mode=False, major_roads_only=False, cached=False):
+    """
+    Estimate the peak memory of a map request
+
+    Args:
+        nodes: OSM street node count of the map area
+        dpi: Export resolution
+        poster_mode: Draw from street lines instead of building graphs
+        major_roads_only: Only motorways down to tertiary roads are fetched
+        cached: The network is cached, so only its street lines are loaded
+
+    Returns:
+        int: Estimated peak bytes
+    """
+    if major_roads_only:
+        nodes *= PREFLIGHT_MAJOR_ROAD_SHARE
+    node_bytes = PREFLIGHT_LINES_NODE_BYTES if poster_mode or cached else PREFLIGHT_GRAPH_NODE_BYTES
+    width, height = MAP_STYLE['figsize']
+    raster_bytes = width * dpi * height * dpi * 4 * PREFLIGHT_RASTER_COPIES
+    return int(nodes * node_bytes + raster_bytes)
+
+
+def reserve_memory(nbytes):
+    """Reserve part of the memory budget; False if it does not fit"""
+    global _memory_reserved
+    with _memory_lock:
+        if _memory_reserved + nbytes > MEMORY_BUDGET_BYTES:
+            return False
+        _memory_reserved += nbytes
+        return True
+
+
+def release_memory(nbytes):
+    """Return memory reserved by reserve_memory to the budget"""
+    global _memory_reserved
+    with _memory_lock:
+        _memory_reserved = max(0, _memory_reserved - nbytes)
+
+
+def admit_map_request(polygon, dpi, poster_mode=False, pbf_path=None, store_key=None, network_types=None):
+    """
+    Size a map request and reserve memory for it, downgrading it to fit
+
+    Args:
+        polygon: Shapely polygon in WGS84
+        dpi: Requested export resolution
+        poster_mode: Whether the request draws from street lines
+        pbf_path: Local .osm.pbf extract the request reads, if any; such
+            requests cannot switch to poster mode or major roads
+        store_key: Key from network_store_key to look up cached networks
+        network_types: Network types the map draws
+
+    Returns:
+        tuple: (success, plan_or_error_message); the plan holds the 'dpi',
+        'poster_mode' and 'major_roads_only' to run with, the 'reserved'
+        bytes to pass to release_memory when done and the 'downgrades' made
+    """
+    nodes, source = estimate_street_nodes(polygon, pbf_path, store_key, network_types)
+    plan = {'dpi': dpi, 'poster_mode': poster_mode, 'major_roads_only': False}
+    downgrades = []
+
+    # A cached network is drawn without building graphs; Poster Mode or
+    # major roads would only download it again
+    cached = source == 'cache' and not poster_mode
+
+    while True:
+        estimate = estimate_request_bytes(nodes, **plan, cached=cached)
+        if reserve_memory(estimate):
+            logger.info(f"Admitted map request: {nodes:,} street nodes ({source}), "
+                        f"{estimate / 1e6:.0f} MB estimated peak, {plan}")
+            return True, {**plan, 'reserved': estimate, 'downgrades': downgrades}
+
+        if plan['dpi'] > PREFLIGHT_MIN_DPI:
+            plan['dpi'] = PREFLIGHT_MIN_DPI
+            downgrades.append(f"image quality was lowered to {PREFLIGHT_MIN_DPI} DPI")
+        elif pbf_path or cached:
+            break
+        elif not plan['poster_mode']:
+            plan['poster_mode'] = True
+            downgrades.append("Poster Mode was turned on")
+        elif not plan['major_roads_only']:
+            plan['major_roads_only'] = True
+            downgrades.append("only major roads are drawn")
         else:
-            simplify = True
-
-        graph = ox.graph_from_polygon(
-            polygon, 
-            network_type="all",
-            simplify=True,
-            retain_all=False,
-            truncate_by_edge=True
-        )
+            break
 
-        logger.info(f"Downloaded network: {len(graph.nodes):,} nodes | {len(graph.edges):,} edges")
-        return True, graph
+    logger.warning(f"Rejected map request: {nodes:,} street nodes ({source}), {estimate / 1e6:.0f} MB estimated peak")
+    if estimate <= MEMORY_BUDGET_BYTES:
+        return False, "The server is busy with other large maps. Try again in a minute."
+    return False, (f"This map would need about {estimate / 1e9:.1f} GB of memory, more than the server's "
+                   f"{MEMORY_BUDGET_BYTES / 1e9:.1f} GB. Try a smaller radius.")
 
-    except Exception as e:
-        logger.error(f"Network download error: {str(e)}")
-        return False, f"Error downloading network: {str(e)}"
 
-# Generate map visualization
-def generate_map_image(graph, city_name, network_types, font_prop=None):
+# ---- Cache warm-up ----
+# Sidebar defaults, shared with the warm-up so warmed entries match a first visit
+DEFAULT_CITY = "College Station, Texas"
+DEFAULT_RADIUS_KM = 10
+DEFAULT_CRS = 2277
+DEFAULT_NETWORK_TYPES = ['drive', 'bike']
+DEFAULT_DPI = 150
+
+# Cities precomputed in the background, separated by ';' (empty disables warm-up)
+WARMUP_CITIES = [
+    city.strip() for city in os.environ.get(
+        "WARMUP_CITIES",
+        f"{DEFAULT_CITY};New York, New York, USA;Barcelona, Spain;"
+        "Amsterdam, Netherlands;Bangkok, Thailand;Sydney, Australia"
+    ).split(';') if city.strip()
+]
+WARMUP_WORKERS = int(os.environ.get("WARMUP_WORKERS", 1))
+
+# Each pass re-reads every city, which also refreshes graphs past their soft TTL
+WARMUP_INTERVAL = int(os.environ.get("WARMUP_INTERVAL", GRAPH_STORE_SOFT_TTL))
+WARMUP_START_DELAY = 30
+
+# Scheduler niceness of warm-up threads, so visitors' requests get the CPU first
+WARMUP_NICENESS = 10
+
+# Overpass requests the warm-up may have in flight, counting hedges
+WARMUP_OVERPASS_WORKERS = 4
+
+
+def warm_city(city_name):
     """
-    Generate map visualization from network graph
+    Fill the geocode, buffer, graph and render caches for a city at the sidebar defaults
 
     Args:
-        graph: NetworkX graph of street network
-        city_name: Name of the city for labeling
-        network_types: String describing network types
-        font_prop: Font properties for text
+        city_name: City to warm
 
     Returns:
-        tuple: (success, figure_or_error_message)
+        tuple: (success, message)
     """
+    start = time.monotonic()
+    success, result = geocode_city(city_name)
+    if not success:
+        return False, result
+
+    request = canonical_request(result["latitude"], result["longitude"], DEFAULT_RADIUS_KM * 1000, DEFAULT_CRS)
+    success, result = create_city_buffer(
+        request["latitude"],
+        request["longitude"],
+        request["buffer_meters"],
+        request["crs_code"]
+    )
+    if not success:
+        return False, result
+
+    # The sidebar defaults to the local extract when one is configured
+    pbf_path = OSM_PBF_PATH
+    polygon = result.geometry.iloc[0]
+    polygon_wkt = polygon.wkt
+    store_key, _ = network_store_key(polygon_wkt, pbf_path, request["key"])
+
+    # Warm-ups share the memory budget with map requests, at the sidebar defaults
+    nodes, source = estimate_street_nodes(polygon, pbf_path, store_key, DEFAULT_NETWORK_TYPES)
+    reserved = estimate_request_bytes(nodes, DEFAULT_DPI, cached=source == 'cache')
+    if not reserve_memory(reserved):
+        return False, f"not enough memory free ({reserved / 1e6:.0f} MB estimated)"
+
     try:
-        # Create figure
-        fig, ax = ox.plot_graph(
-            graph,
-            figsize=(20, 20),
-            node_size=0,
-            edge_color='white',
-            edge_linewidth=0.5,
-            bgcolor='black',
-            show=False,
-            close=False
+        # Same lookup order as main(): shared lines, the stored network, a download
+        lines = (
+            shared_graph_acquire(street_lines_key(store_key, DEFAULT_NETWORK_TYPES))
+            or stored_street_lines(store_key, DEFAULT_NETWORK_TYPES)
         )
-     
-        formatted_city_name = city_name.title()
-
-        # Base style
-        base_kwargs = {
-            'color': 'white',
-            'ha': 'left',
-            'va': 'bottom',
-            'transform': ax.transAxes}
-        
-        if font_prop:
-            base_kwargs['fontproperties'] = font_prop
-
-        city_kwargs = dict(base_kwargs)
-        city_kwargs.update({'fontsize': 20, 'weight': 'bold'})
-        network_kwargs = dict(base_kwargs)
-        network_kwargs.update({'fontsize': 15})
-
-        # Place at bottom inside axes; minimal gap
-        x_position = 0.05
-        city_y = 0.03
-        gap = 0.025 
-        network_y = city_y + gap
-
-        ax.text(x_position, network_y, network_types, **network_kwargs)
-        ax.text(x_position, city_y, formatted_city_name, **city_kwargs)
-
-        # Add credit at BOTTOM RIGHT
-        credit_kwargs = {
-            'color': 'white',
-            'ha': 'right',              
-            'va': 'bottom',
-            'fontsize': 9,             
-            'alpha': 0.7,               
-            'transform': ax.transAxes
-        }
-        if font_prop:
-            credit_kwargs['fontproperties'] = font_prop
-            
-        ax.text(0.95, 0.03, 'App by Pradip Shrestha, 2026', **credit_kwargs)
-        
-        fig.subplots_adjust(top=0.98, bottom=0.02)
+        if lines is not None:
+            refresh_if_stale(store_key, lines['snapshot_time'], polygon_wkt, pbf_path, request["key"])
+        else:
+            results = download_networks(polygon_wkt, DEFAULT_NETWORK_TYPES, pbf_path=pbf_path, request_key=request["key"])
+            graphs = [graph for ok, graph in results.values() if ok]
+            try:
+                failed = [network_type for network_type, (ok, _) in results.items() if not ok]
+                if failed:
+                    return False, f"{', '.join(failed)} network(s) failed"
 
-        logger.info("Map visualization created successfully")
-        return True, fig
+                lines = shared_street_lines(store_key, DEFAULT_NETWORK_TYPES, graphs)
+            finally:
+                for graph in graphs:
+                    release_shared_graph(graph)
+
+        try:
+            # Same key main() computes for a first visit with the default settings
+            font_prop = load_custom_font()
+            network_label = " and ".join(NETWORK_LABELS[t] for t in DEFAULT_NETWORK_TYPES)
+            render_key = render_cache_key(
+                store_key, lines['snapshot_time'], city_name, network_label, DEFAULT_DPI, font_prop
+            )
+            if render_cache_get(render_key)[0] is None:
+                success, result = generate_lines_image(
+                    select_street_lines(lines, DEFAULT_NETWORK_TYPES), lines['bounds'], city_name, network_label, font_prop
+                )
+                if not success:
+                    return False, result
+                render_cache_put(render_key, *render_figure(result, dpi=DEFAULT_DPI))
+                plt.close(result)
+        finally:
+            release_shared_graph(lines)
+    finally:
+        release_memory(reserved)
+
+    return True, f"warm in {time.monotonic() - start:.1f}s"
+
+
+def _lower_thread_priority():
+    """Thread pool initializer giving a worker the warm-up niceness"""
+    try:
+        # Per-thread on Linux; threads started from the worker inherit it
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), WARMUP_NICENESS)
+    except (AttributeError, OSError) as e:
+        logger.info(f"Cache warm-up runs at normal priority: {e}")
 
-    except Exception as e:
-        logger.error(f"Map generation error: {str(e)}")
-        return False, f"Error generating map: {str(e)}"
 
-# Convert figure to bytes for download
-def fig_to_bytes(fig, dpi=150):
-    """Convert matplotlib figure to bytes"""
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png', dpi=dpi, bbox_inches='tight', facecolor='black')
-    buf.seek(0)
-    return buf
+def _run_cache_warmer(cities):
+    """Warm the cities forever, one pass every WARMUP_INTERVAL seconds"""
+    # Low-priority pools of the warm-up's own, so shared pool threads are
+    # never started by (and inherit the niceness of) a warm-up thread
+    _overpass_pool.set(ThreadPoolExecutor(
+        max_workers=WARMUP_OVERPASS_WORKERS, thread_name_prefix="warmup-overpass", initializer=_lower_thread_priority
+    ))
+    _refresh_pool.set(ThreadPoolExecutor(
+        max_workers=MAX_REFRESH_WORKERS, thread_name_prefix="warmup-refresh", initializer=_lower_thread_priority
+    ))
+
+    time.sleep(WARMUP_START_DELAY)
+    while True:
+        with ThreadPoolExecutor(
+            max_workers=WARMUP_WORKERS, thread_name_prefix="warmup", initializer=_lower_thread_priority
+        ) as executor:
+            futures = {executor.submit(contextvars.copy_context().run, warm_city, city): city for city in cities}
+            for future in as_completed(futures):
+                try:
+                    success, message = future.result()
+                except Exception as e:
+                    success, message = False, str(e)
+                if success:
+                    logger.info(f"Cache warm-up {futures[future]}: {message}")
+                else:
+                    logger.warning(f"Cache warm-up {futures[future]} failed: {message}")
+        time.sleep(WARMUP_INTERVAL)
+
+
+# Started once per server process, by the first script run
+@st.cache_resource
+def start_cache_warmer():
+    """Start the background cache warm-up thread"""
+    if not WARMUP_CITIES:
+        return None
+    thread = threading.Thread(target=_run_cache_warmer, args=(WARMUP_CITIES,), name="cache-warmer", daemon=True)
+    thread.start()
+    logger.info(f"Cache warm-up started for {len(WARMUP_CITIES)} cities")
+    return thread
+
 
 # Main app
 def main():
@@ -284,6 +4362,9 @@ def main():
     st.title("City Transport Map Generator")
     st.markdown("Generate street network maps from OpenStreetMap data")
 
+    start_cache_warmer()
+    start_metrics_exporter()
+
     # Sidebar for inputs
     with st.sidebar:
         st.header("⚙️ Map Settings")
@@ -291,7 +4372,7 @@ def main():
         # City input
         city_name = st.text_input(
             "City Name",
-            value="College Station, Texas",
+            value=DEFAULT_CITY,
             help="Enter city name. Include state/country for better results (e.g., 'Paris, France')"
         )
 
@@ -300,7 +4381,7 @@ def main():
             "Map Radius (km)",
             min_value=5,
             max_value=50,
-            value=10,
+            value=DEFAULT_RADIUS_KM,
             step=5,
             help="Area to include around city center"
         )
@@ -322,28 +4403,47 @@ def main():
         crs_choice = st.selectbox(
             "Coordinate System",
             options=list(crs_options.keys()),
-            index=2,
+            index=list(crs_options.values()).index(DEFAULT_CRS),
             help="Choose appropriate CRS for your region"
         )
         crs = crs_options[crs_choice]
 
+        # Data source selection (only offered when a local extract is configured)
+        pbf_path = None
+        if OSM_PBF_PATH:
+            data_source = st.radio(
+                "Data Source",
+                options=["Overpass API (live)", "Local OSM extract"],
+                index=1,
+                help=f"Local extract: {OSM_PBF_PATH}"
+            )
+            if data_source == "Local OSM extract":
+                pbf_path = OSM_PBF_PATH
+
         # Network type selection
         st.markdown("---")
         st.subheader("Network Types")
 
-        include_drive = st.checkbox("Driving Road", value=True)
-        include_bike = st.checkbox("Bike Path", value=True)
-        include_walk = st.checkbox("Walking Street", value=False)
+        include_drive = st.checkbox("Driving Road", value='drive' in DEFAULT_NETWORK_TYPES)
+        include_bike = st.checkbox("Bike Path", value='bike' in DEFAULT_NETWORK_TYPES)
+        include_walk = st.checkbox("Walking Street", value='walk' in DEFAULT_NETWORK_TYPES)
 
         if not (include_drive or include_bike or include_walk):
             st.warning("⚠️ Select at least one network type")
 
+        poster_mode = st.checkbox(
+            "Poster Mode (faster)",
+            value=False,
+            help="Draw streets straight from OSM ways without building a street graph. "
+                 "Much faster and lighter for large cities; uses the Overpass API only"
+        )
+
         # Resolution
         st.markdown("---")
         dpi = st.select_slider(
             "Image Quality (DPI)",
             options=[72, 150, 300, 600],
-            value=150,
+            value=DEFAULT_DPI,
             help="Higher DPI = better quality but larger file size"
         )
 
@@ -385,6 +4485,8 @@ def main():
         with progress_container:
             progress_bar = st.progress(0)
             status_text = st.empty()
+            held = []
+            reserved = 0
 
             try:
                 # Step 1: Geocode city
@@ -402,11 +4504,12 @@ def main():
 
                 # Step 2: Create buffer
                 status_text.text("📍 Creating study area...")
+                request = canonical_request(location["latitude"], location["longitude"], buffer_meters, crs)
                 success, result = create_city_buffer(
-                    location["latitude"],
-                    location["longitude"],
-                    buffer_meters,
-                    crs
+                    request["latitude"],
+                    request["longitude"],
+                    request["buffer_meters"],
+                    request["crs_code"]
                 )
 
                 if not success:
@@ -414,90 +4517,166 @@ def main():
                     st.stop()
 
                 cities_df = result
+                polygon_wkt = cities_df.geometry.iloc[0].wkt
+                selected_networks = [
+                    network_type for network_type, include in
+                    (('drive', include_drive), ('bike', include_bike), ('walk', include_walk))
+                    if include
+                ]
+                store_key, _ = network_store_key(polygon_wkt, pbf_path, request["key"])
+
+                # Pre-flight: size the request against the memory budget
+                status_text.text("📏 Estimating map size...")
+                success, result = admit_map_request(
+                    cities_df.geometry.iloc[0], dpi, poster_mode and not pbf_path, pbf_path,
+                    store_key, selected_networks
+                )
+                if not success:
+                    st.error(f"❌ {result}")
+                    st.stop()
+
+                reserved = result['reserved']
+                if result['downgrades']:
+                    st.warning(f"⚠️ This map is too large for the server's memory, so {', '.join(result['downgrades'])}")
+                dpi = result['dpi']
+                poster_mode = result['poster_mode']
+                major_roads_only = result['major_roads_only']
                 progress_bar.progress(30)
 
                 # Step 3: Download networks
-                polygon_wkt = cities_df.geometry.iloc[0].wkt
-                graphs = []
                 networks_downloaded = []
+                progress = DownloadProgress()
+                fig = None
 
-                total_networks = sum([include_drive, include_bike, include_walk])
-                current_network = 0
+                def report_progress(snapshot):
+                    status_text.text(
+                        f"{snapshot['phase']}... {snapshot['bytes'] / 1e6:.1f} MB received, "
+                        f"{snapshot['elements']:,} elements parsed ({snapshot['elapsed']:.0f}s)"
+                    )
+                    progress_bar.progress(30 + int(snapshot['fraction'] * 45))
 
-                if include_drive:
-                    current_network += 1
-                    status_text.text(f"Downloading driving network ({current_network}/{total_networks})...")
-                    success, result = download_osm_network(polygon_wkt, 'drive')
+                if poster_mode and not pbf_path:
+                    # Poster mode: street geometry only, no graph
+                    status_text.text("Downloading street geometry...")
+                    ctx = get_script_run_ctx()
+                    with ThreadPoolExecutor(max_workers=1, initializer=partial(add_script_run_ctx, None, ctx)) as executor:
+                        future = executor.submit(
+                            download_street_lines, polygon_wkt, request["key"], major_roads_only, progress
+                        )
+                        for _ in poll_with_progress([future], progress, report_progress):
+                            pass
+                    success, result = future.result()
+                    if not success:
+                        st.error(f"❌ {result}")
+                        st.stop()
 
-                    if success:
-                        graphs.append(result)
-                        networks_downloaded.append("Drive")
-                        st.success("Drive network downloaded")
-                    else:
-                        st.warning(f"⚠️ {result}")
+                    segments = select_street_lines(result, selected_networks)
+                    if not segments:
+                        st.error("No streets found for the selected network types. Try a different city or network type.")
+                        st.stop()
 
-                    progress_bar.progress(30 + (current_network * 20))
+                    networks_downloaded = [NETWORK_LABELS[t] for t in selected_networks]
+                    st.info(f"Map contains {len(segments):,} street ways")
 
-                if include_bike:
-                    current_network += 1
-                    status_text.text(f"Downloading bike network ({current_network}/{total_networks})...")
-                    success, result = download_osm_network(polygon_wkt, 'bike')
+                    status_text.text("Creating visualization...")
+                    progress_bar.progress(90)
 
-                    if success:
-                        graphs.append(result)
-                        networks_downloaded.append("Bike")
-                        st.success("Bike network downloaded")
+                    network_label = " and ".join(networks_downloaded)
+                    if major_roads_only:
+                        network_label += " (Major Roads)"
+                    render_key = render_cache_key(
+                        f"poster:{request['key']}", result['snapshot_time'], city_name, network_label, dpi, font_prop
+                    )
+                    render_start = time.monotonic()
+                    img_bytes, preview = cached_render(render_key)
+                    if img_bytes is None:
+                        success, result = generate_lines_image(segments, result['bounds'], city_name, network_label, font_prop)
+
+                        if not success:
+                            st.error(f"❌ {result}")
+                            st.stop()
+                        fig = result
+
+                else:
+                    # Street lines built by an earlier run, or read from a stored
+                    # full network, need no graphs at all
+                    lines = shared_graph_acquire(street_lines_key(store_key, selected_networks))
+                    if lines is not None:
+                        record_cache_hit("network")
+                    else:
+                        lines = stored_street_lines(store_key, selected_networks)
+                    if lines is not None:
+                        held.append(lines)
+                        networks_downloaded = [NETWORK_LABELS[t] for t in selected_networks]
+                        refresh_if_stale(store_key, lines['snapshot_time'], polygon_wkt, pbf_path, request["key"])
                     else:
-                        st.warning(f"⚠️ {result}")
+                        total_networks = len(selected_networks)
+                        status_text.text(f"Downloading {total_networks} network(s)...")
 
-                    progress_bar.progress(30 + (current_network * 20))
+                        def report_download(network_type, success, result, done, total):
+                            if success:
+                                st.success(f"{NETWORK_LABELS[network_type]} network downloaded")
+                            else:
+                                st.warning(f"⚠️ {result}")
+                            status_text.text(f"Downloaded networks ({done}/{total})...")
 
-                if include_walk:
-                    current_network += 1
-                    status_text.text(f"Downloading street network ({current_network}/{total_networks})...")
-                    success, result = download_osm_network(polygon_wkt, 'walk')
+                        results = download_networks(
+                            polygon_wkt, selected_networks, on_complete=report_download,
+                            pbf_path=pbf_path, request_key=request["key"],
+                            progress=progress, on_progress=report_progress
+                        )
 
-                    if success:
-                        graphs.append(result)
-                        networks_downloaded.append("Walk")
-                        st.success("Walk network downloaded")
-                    else:
-                        st.warning(f"⚠️ {result}")
+                        # Keep a stable drive, bike, walk order for the map label
+                        downloaded_types = [t for t in selected_networks if results[t][0]]
+                        graphs = [results[t][1] for t in downloaded_types]
+                        networks_downloaded = [NETWORK_LABELS[t] for t in downloaded_types]
 
-                    progress_bar.progress(30 + (current_network * 20))
+                        try:
+                            if not graphs:
+                                st.error("No networks could be downloaded. Try a different city or smaller radius.")
+                                st.stop()
 
-                if not graphs:
-                    st.error("No networks could be downloaded. Try a different city or smaller radius.")
-                    st.stop()
+                            # Step 4: Combine networks
+                            status_text.text("Combining networks...")
+                            progress_bar.progress(80)
 
-                # Step 4: Combine networks
-                status_text.text("Combining networks...")
-                progress_bar.progress(80)
+                            lines = shared_street_lines(store_key, downloaded_types, graphs)
+                        finally:
+                            # The graphs stay cached for other sessions; only the lines are drawn
+                            for graph in graphs:
+                                release_shared_graph(graph)
+                        held.append(lines)
 
-                if len(graphs) > 1:
-                    combined_graph = graphs[0]
-                    for g in graphs[1:]:
-                        combined_graph = nx.compose(combined_graph, g)
-                else:
-                    combined_graph = graphs[0]
+                    # Tiled fetches of large areas may be missing a few tiles
+                    if lines['missing_tiles']:
+                        st.warning(f"⚠️ {lines['missing_tiles']} map tiles could not be downloaded; the map may have gaps")
 
-                # Network statistics
-                st.info(f"Network contains {len(combined_graph.nodes):,} nodes and {len(combined_graph.edges):,} edges")
+                    # Network statistics
+                    st.info(f"Network contains {lines['node_count']:,} nodes and {lines['edge_count']:,} edges")
 
-                # Step 5: Generate map
-                status_text.text("Creating visualization...")
-                progress_bar.progress(90)
+                    # Step 5: Generate map
+                    status_text.text("Creating visualization...")
+                    progress_bar.progress(90)
 
-                # Create network types label
-                network_label = " and ".join(networks_downloaded)
-                
-                success, result = generate_map_image(combined_graph, city_name, network_label, font_prop)
+                    # Create network types label
+                    network_label = " and ".join(networks_downloaded)
 
-                if not success:
-                    st.error(f"❌ {result}")
-                    st.stop()
+                    render_key = render_cache_key(
+                        store_key, lines['snapshot_time'], city_name, network_label, dpi, font_prop
+                    )
+                    render_start = time.monotonic()
+                    img_bytes, preview = cached_render(render_key)
+                    if img_bytes is None:
+                        success, result = generate_lines_image(
+                            select_street_lines(lines, selected_networks), lines['bounds'],
+                            city_name, network_label, font_prop
+                        )
+
+                        if not success:
+                            st.error(f"❌ {result}")
+                            st.stop()
+                        fig = result
 
-                fig = result
                 progress_bar.progress(100)
                 status_text.text("✅ Map generated successfully!")
                 time.sleep(0.5)
@@ -509,11 +4688,19 @@ def main():
                 st.success(f"Map of {city_name} generated successfully!")
                 st.markdown(f"**Networks included:** {', '.join(networks_downloaded)}")
 
-                st.pyplot(fig)
+                if fig is not None:
+                    # One rasterization serves both the preview and the download
+                    img_bytes, preview = render_figure(fig, dpi=dpi)
+
+                    # Close figure to free memory
+                    plt.close(fig)
+                    remember_render(render_key, img_bytes, preview, time.monotonic() - render_start)
+
+                # Repeat exports are served from the render cache
+                st.image(preview, width="stretch")
 
                 # Download button
                 filename = f"{city_name.replace(' ', '_').replace(',', '')}_transport_map.png"
-                img_bytes = fig_to_bytes(fig, dpi=dpi)
 
                 st.download_button(
                     label=f"Download Map (PNG, {dpi} DPI)",
@@ -523,14 +4710,17 @@ def main():
                     type="primary"
                 )
 
-                # Close figure to free memory
-                plt.close(fig)
-
             except Exception as e:
                 logger.error(f"Unexpected error: {str(e)}")
                 st.error(f"❌ An unexpected error occurred: {str(e)}")
                 st.info("💡 Try reducing the map radius or choosing a different city")
 
+            finally:
+                # The street lines stay cached for other sessions but are no longer pinned by this one
+                for value in held:
+                    release_shared_graph(value)
+                release_memory(reserved)
+
     else:
         # Show welcome message when no map generated
         st.info(" Configure your map settings in the sidebar and click 'Generate Map' to begin")
@@ -540,5 +4730,57 @@ def main():
 
         col_a, col_b = st.columns(2)
 
+    if ADMIN_PANEL:
+        show_cache_metrics_panel()
+
+def cache_admin(argv):
+    """
+    Command line tool for the Overpass response cache
+
+    Usage: python city_map_app.py cache-admin {inspect,prune,compact} [options]
+
+    Args:
+        argv: Arguments after "cache-admin"
+
+    Returns:
+        int: Process exit code
+    """
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="city_map_app.py cache-admin", description="Manage the Overpass response cache")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("inspect", help="Show cache size and contents")
+    prune = commands.add_parser("prune", help="Remove old or least recently used responses")
+    prune.add_argument("--max-bytes", type=int, help="Evict least recently used responses down to this size")
+    prune.add_argument("--older-than", type=int, help="Remove responses created more than this many seconds ago")
+    commands.add_parser("compact", help="Recompress responses at the strong level and remove stray files")
+    args = parser.parse_args(argv)
+
+    configure_osmnx()
+    if args.command == "inspect":
+        stats = inspect_response_cache()
+        ratio = stats['raw_bytes'] / stats['bytes'] if stats['bytes'] else 0
+        print(f"Cache folder:  {RESPONSE_CACHE_DIR.resolve()}")
+        print(f"Responses:     {stats['entries']:,}")
+        print(f"Size:          {stats['bytes'] / 1e6:.1f} MB of {stats['max_bytes'] / 1e6:.0f} MB "
+              f"({stats['raw_bytes'] / 1e6:.1f} MB uncompressed, {ratio:.1f}x)")
+        if stats['oldest'] is not None:
+            print(f"Created:       {time.ctime(stats['oldest'])} .. {time.ctime(stats['newest'])}")
+        print(f"Stray files:   {stats['orphans']:,} ({stats['orphan_bytes'] / 1e6:.1f} MB)")
+    elif args.command == "prune":
+        if args.max_bytes is None and args.older_than is None:
+            parser.error("prune needs --max-bytes and/or --older-than")
+        removed, freed = prune_response_cache(args.max_bytes, args.older_than)
+        print(f"Removed {removed:,} responses ({freed / 1e6:.1f} MB)")
+    elif args.command == "compact":
+        before, after = compact_response_cache()
+        print(f"Compacted {before / 1e6:.1f} MB -> {after / 1e6:.1f} MB")
+    return 0
+
+
 if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "cache-admin":
+        sys.exit(cache_admin(sys.argv[2:]))
     main()
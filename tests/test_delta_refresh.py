@@ -0,0 +1,99 @@
+"""Offline delta refresh checks against a recorded augmented diff"""
+import json
+from pathlib import Path
+
+import pytest
+from shapely.geometry import box
+
+import city_map_app as app
+
+FIXTURES = Path(__file__).parent / "fixtures"
+POLYGON = box(13.399, 52.499, 13.404, 52.5035)
+
+
+def load_elements(name):
+    with open(FIXTURES / name, encoding="utf-8") as f:
+        return json.load(f)["elements"]
+
+
+def recorded_fetch(elements):
+    """Stand in for fetch_way_elements, answering from recorded elements"""
+    ways = {e["id"]: e for e in elements if e["type"] == "way"}
+    nodes = {e["id"]: e for e in elements if e["type"] == "node"}
+    calls = []
+
+    def fetch_elements(way_ids, neighbours=False):
+        calls.append((set(way_ids), neighbours))
+        found = [ways[i] for i in way_ids if i in ways]
+        if neighbours:
+            shared = {n for way in found for n in way["nodes"]}
+            found += [w for i, w in ways.items() if i not in way_ids and shared & set(w["nodes"])]
+        return iter(found + [nodes[n] for n in sorted({n for way in found for n in way["nodes"]})])
+
+    fetch_elements.calls = calls
+    return fetch_elements
+
+
+def drawn_segments(graph):
+    """Map every directed street segment to its highway tag"""
+    segments = {}
+    for u, v, data in graph.edges(data=True):
+        if "geometry" in data:
+            coords = list(data["geometry"].coords)
+        else:
+            coords = [(graph.nodes[n]["x"], graph.nodes[n]["y"]) for n in (u, v)]
+        for a, b in zip(coords, coords[1:]):
+            segments[(a, b)] = data["highway"]
+    return segments
+
+
+@pytest.fixture(scope="module", autouse=True)
+def osmnx_settings():
+    app.configure_osmnx()
+
+
+def test_parse_augmented_diff():
+    with open(FIXTURES / "adiff.xml", "rb") as f:
+        changed, actions = app.parse_augmented_diff(f)
+
+    assert changed == {101, 106, 107}
+    assert actions == {"modify": 1, "delete": 1, "create": 1}
+
+
+def test_parse_augmented_diff_runtime_error(tmp_path):
+    path = tmp_path / "timeout.xml"
+    path.write_text(
+        '<?xml version="1.0" encoding="UTF-8"?>\n<osm version="0.6">\n'
+        "<remark> runtime error: Query timed out in \"query\" at line 1 after 26 seconds. </remark>\n"
+        "</osm>\n"
+    )
+    with open(path, "rb") as f, pytest.raises(ValueError, match="runtime error"):
+        app.parse_augmented_diff(f)
+
+
+def test_patch_matches_fresh_build():
+    graph = app.finalize_network_graph(app.build_network_graph(load_elements("base_elements.json")), POLYGON)
+    current = load_elements("current_elements.json")
+    fresh = app.finalize_network_graph(app.build_network_graph(current), POLYGON)
+    with open(FIXTURES / "adiff.xml", "rb") as f:
+        changed, _ = app.parse_augmented_diff(f)
+
+    fetch_elements = recorded_fetch(current)
+    patched = app.patch_network_graph(graph, POLYGON, changed, fetch_elements=fetch_elements)
+
+    assert fetch_elements.calls[0] == (changed, True)
+    assert drawn_segments(patched) == drawn_segments(fresh)
+    assert set(fresh.nodes) <= set(patched.nodes)
+    assert 106 not in {w for _, _, osmid in patched.edges(data="osmid") for w in (osmid if isinstance(osmid, list) else [osmid])}
+    for n, count in fresh.nodes(data="street_count"):
+        assert patched.nodes[n]["street_count"] == count
+
+
+def test_patch_without_changes_keeps_graph():
+    elements = load_elements("base_elements.json")
+    graph = app.finalize_network_graph(app.build_network_graph(elements), POLYGON)
+    before = drawn_segments(graph)
+
+    patched = app.patch_network_graph(graph, POLYGON, set(), fetch_elements=recorded_fetch(elements))
+
+    assert drawn_segments(patched) == before